@@ -1,5 +1,54 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model, user_logged_out
+from django.db.models.signals import post_delete, post_save
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from rest_framework.authtoken.models import Token
+
+        from recipe.models import Ingredient, Tag
+
+        from .authentication import token_cache
+        from .autocomplete import ingredient_index
+        from .views import IngredientViewSet, TagViewSet
+
+        # Индекс автодополнения перестраивается после изменения ингредиентов
+        post_save.connect(
+            ingredient_index.invalidate,
+            sender=Ingredient,
+            dispatch_uid='ingredient_index_save'
+        )
+        post_delete.connect(
+            ingredient_index.invalidate,
+            sender=Ingredient,
+            dispatch_uid='ingredient_index_delete'
+        )
+
+        # Готовые ответы справочников сбрасываются после их изменения
+        for model, viewset in ((Tag, TagViewSet),
+                               (Ingredient, IngredientViewSet)):
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    viewset.invalidate_list_cache,
+                    sender=model,
+                    dispatch_uid='{}_list_cache'.format(viewset.__name__)
+                )
+
+        # Кэш аутентификации: выход, смена пароля, деактивация
+        post_delete.connect(
+            token_cache.on_token_delete,
+            sender=Token,
+            dispatch_uid='token_cache_token_delete'
+        )
+        post_save.connect(
+            token_cache.on_user_change,
+            sender=get_user_model(),
+            dispatch_uid='token_cache_user_save'
+        )
+        user_logged_out.connect(
+            token_cache.on_user_change,
+            dispatch_uid='token_cache_logout'
+        )
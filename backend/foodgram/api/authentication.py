@@ -0,0 +1,158 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from .cache import is_shared_cache
+
+
+def shared_key(key):
+    return 'auth-token:{}'.format(hashlib.sha1(key.encode()).hexdigest())
+
+
+def generation_key(user_id):
+    return 'auth-user-generation:{}'.format(user_id)
+
+
+class TokenCache:
+    """Кэш токенов: LRU в памяти воркера с временем жизни записей
+    и общий кэш Django вторым уровнем.
+
+    Хранятся сериализованные токены с пользователем: каждый запрос
+    получает свои экземпляры моделей. Запись действительна, пока
+    не сменилось поколение пользователя в общем кэше: выход, смена
+    пароля и деактивация увеличивают его, и записи всех воркеров
+    устаревают сразу. Без общего кэша (память процесса) сброс
+    не дошел бы до других воркеров, поэтому кэш выключен
+    """
+
+    def __init__(self, size, ttl, shared=False):
+        self.size = size
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        if not self.shared:
+            return None
+        entry = self._lookup(key)
+        if entry is None:
+            entry = cache.get(shared_key(key))
+            if entry is not None:
+                self._store(key, *entry)
+        if entry is not None and entry[1] != self.generation(entry[0]):
+            self.evict(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(entry[2])
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def set(self, token):
+        if not self.shared:
+            return
+        entry = (
+            token.user_id, self.generation(token.user_id),
+            pickle.dumps(token)
+        )
+        self._store(token.key, *entry)
+        cache.set(shared_key(token.key), entry, self.ttl)
+
+    def _store(self, key, user_id, generation, payload):
+        with self._lock:
+            self._entries[key] = (
+                time.monotonic() + self.ttl, user_id, generation, payload
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def generation(self, user_id):
+        return cache.get(generation_key(user_id), 0)
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared:
+            cache.delete(shared_key(key))
+
+    def evict_user(self, user_id):
+        """Записи пользователя устаревают во всех воркерах"""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if entry[1] == user_id]:
+                del self._entries[key]
+        if not self.shared:
+            return
+        try:
+            cache.incr(generation_key(user_id))
+        except ValueError:
+            cache.set(generation_key(user_id), 1, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self.size,
+            'ttl': self.ttl,
+            'shared': self.shared,
+        }
+
+    # Обработчики сигналов: выход, смена пароля, изменение пользователя
+
+    def on_token_delete(self, instance, **kwargs):
+        self.evict(instance.key)
+        self.evict_user(instance.user_id)
+
+    def on_user_change(self, user=None, instance=None, **kwargs):
+        user = user or instance
+        if user is not None and user.pk is not None:
+            self.evict_user(user.pk)
+
+
+token_cache = TokenCache(
+    size=settings.TOKEN_AUTH_CACHE_SIZE,
+    ttl=settings.TOKEN_AUTH_CACHE_TTL,
+    shared=is_shared_cache(),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса Token + User на каждый вызов API.
+
+    Записи сбрасываются сигналами при выходе (удаление токена),
+    смене пароля и деактивации (сохранение пользователя)
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is not None:
+            return token.user, token
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(token)
+        return user, token
@@ -0,0 +1,103 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from recipe.models import Ingredient
+
+
+def normalize(value):
+    """Приведение строки к виду для поиска: регистр и ё/е не важны"""
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Индекс ингредиентов для автодополнения.
+
+    Хранит отсортированный массив нормализованных имен
+    и параллельный массив готовых к выдаче записей.
+    Поиск по префиксу - бинарный, затем (если лимит не набран)
+    добираются совпадения по подстроке. База не затрагивается,
+    пока индекс актуален.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = None
+        self._built_at = 0
+
+    def build(self):
+        rows = sorted(
+            (normalize(name), pk, name, unit)
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        )
+        keys = [row[0] for row in rows]
+        items = [
+            {'id': pk, 'name': name, 'measurement_unit': unit}
+            for _, pk, name, unit in rows
+        ]
+        # Подмена одной ссылкой: читатели видят либо старый,
+        # либо новый индекс целиком
+        self._data = (keys, items)
+        self._built_at = time.monotonic()
+
+    def warm_up(self):
+        """Построение индекса при старте воркера.
+        Если база еще не готова - индекс построится при первом поиске
+        """
+        try:
+            self.build()
+        except DatabaseError:
+            self._data = None
+
+    def invalidate(self, **kwargs):
+        self._data = None
+
+    def is_stale(self):
+        return bool(
+            self.ttl and time.monotonic() - self._built_at > self.ttl
+        )
+
+    def get_data(self):
+        if self._data is None or self.is_stale():
+            with self._lock:
+                if self._data is None or self.is_stale():
+                    self.build()
+        return self._data
+
+    def search(self, query, limit=None):
+        """Сначала совпадения по началу имени, затем по подстроке"""
+        keys, items = self.get_data()
+        query = normalize(query)
+        if limit is None:
+            limit = len(keys)
+        if not query:
+            return items[:limit]
+
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and end - start < limit:
+            if not keys[end].startswith(query):
+                break
+            end += 1
+        result = items[start:end]
+
+        if len(result) < limit:
+            for position, key in enumerate(keys):
+                if start <= position < end:
+                    continue
+                if query in key:
+                    result.append(items[position])
+                    if len(result) == limit:
+                        break
+        return result
+
+
+ingredient_index = IngredientIndex(
+    ttl=getattr(settings, 'INGREDIENT_INDEX_TTL', None)
+)
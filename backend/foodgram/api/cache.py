@@ -0,0 +1,11 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Кэши в памяти процесса: каждый воркер видит только свои записи
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def is_shared_cache(alias='default'):
+    """Общий ли кэш alias для всех воркеров"""
+    return not isinstance(caches[alias], PROCESS_LOCAL_CACHES)
@@ -0,0 +1,117 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger('api.db_router')
+
+_local = threading.local()
+
+# Модели, которые всегда читаются с основной базы:
+# токен, выданный при входе, нужен уже в следующем запросе,
+# а записи DatabaseCache (привязки к основной базе) - сразу после записи
+PRIMARY_ONLY_MODELS = ('authtoken.token', 'django_cache.cacheentry')
+
+
+def model_label(model):
+    # У модели DatabaseCache нет _meta.label_lower
+    return '{}.{}'.format(model._meta.app_label, model._meta.model_name)
+
+
+def get_pin_key(request):
+    """Ключ привязки клиента к основной базе: токен или сессия"""
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    return 'replica-pin:{}'.format(
+        hashlib.sha1(credentials.encode()).hexdigest()
+    )
+
+
+def is_pinned(key):
+    return key is not None and cache.get(key) is not None
+
+
+def pin(key):
+    if key is not None:
+        cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+
+
+def start_request(use_replica):
+    _local.use_replica = use_replica
+    _local.written = False
+
+
+def finish_request():
+    """Завершение запроса; возвращает, была ли в нем запись"""
+    try:
+        return getattr(_local, 'written', False)
+    finally:
+        _local.use_replica = False
+        _local.written = False
+
+
+class ReplicaRouter:
+    """Чтение в безопасных запросах - с реплик, остальное - с основной.
+
+    Реплики используются только внутри запроса, размеченного
+    ReplicaPinningMiddleware; команды, сигналы и фоновые задачи
+    работают с основной базой. После первой записи в запросе
+    чтение до его конца идет с основной базы.
+    Недоступная реплика исключается до следующей проверки
+    """
+
+    def __init__(self):
+        self._health = {}
+
+    def db_for_read(self, model, **hints):
+        if (not getattr(_local, 'use_replica', False)
+                or getattr(_local, 'written', False)
+                or model_label(model) in PRIMARY_ONLY_MODELS):
+            return 'default'
+        replicas = [
+            alias for alias in settings.DATABASE_REPLICAS
+            if self.is_healthy(alias)
+        ]
+        if not replicas:
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _local.written = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+    def is_healthy(self, alias):
+        checked_at, healthy = self._health.get(alias, (None, False))
+        now = time.monotonic()
+        if (checked_at is None
+                or now - checked_at > settings.REPLICA_HEALTH_CHECK_INTERVAL):
+            healthy = self.check(alias)
+            self._health[alias] = (now, healthy)
+        return healthy
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            logger.warning('Replica %s is unavailable', alias, exc_info=True)
+            connection.close()
+            return False
+        return True
@@ -1,7 +1,10 @@
+from django.db.models import Exists, OuterRef
 from django_filters import FilterSet
-from django_filters.filters import CharFilter
+from django_filters.filters import CharFilter, NumberFilter, RangeFilter
+from django_filters.rest_framework import BooleanFilter
 
-from recipe.models import Ingredient
+from recipe.models import Ingredient, Recipe, RecipeTag
+from recipe.search import search_recipes
 
 
 class IngredientFilter(FilterSet):
@@ -15,3 +18,62 @@ class IngredientFilter(FilterSet):
         fields = {
             'name': ['iexact', 'istartswith', 'icontains'],
         }
+
+
+class RecipeFilter(FilterSet):
+    """Фильтры рецептов.
+
+    Все фильтры сочетаются друг с другом; принадлежность к избранному,
+    корзине и тегам проверяется подзапросами EXISTS, без соединений
+    и DISTINCT по всей выборке. search - полнотекстовый поиск
+    по названию, ингредиентам и тексту с сортировкой по релевантности
+    """
+    is_favorited = BooleanFilter(method='filter_is_favorited')
+    is_in_shopping_cart = BooleanFilter(method='filter_is_in_shopping_cart')
+    author = NumberFilter(field_name='author')
+    tags = CharFilter(method='filter_tags')
+    cooking_time = RangeFilter(field_name='cooking_time')
+    search = CharFilter(method='filter_search')
+
+    class Meta:
+        model = Recipe
+        fields = (
+            'is_favorited', 'is_in_shopping_cart',
+            'author', 'tags', 'cooking_time', 'search'
+        )
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_relation(queryset, name, 'fav_list', value)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_relation(queryset, name, 'cart_list', value)
+
+    def filter_user_relation(self, queryset, name, related_name, value):
+        """Отбор по связи рецепта с текущим пользователем.
+        Аннотация из выборки используется, если она уже есть
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+
+        if name not in queryset.query.annotations:
+            queryset = queryset.annotate(**{
+                name: Exists(
+                    getattr(user, related_name).filter(recipe=OuterRef('pk'))
+                )
+            })
+        return queryset.filter(**{name: value})
+
+    def filter_tags(self, queryset, name, value):
+        slugs = self.data.getlist(name)
+        return queryset.annotate(
+            has_tags=Exists(
+                RecipeTag.objects.filter(
+                    recipe=OuterRef('pk'),
+                    tag__slug__in=slugs
+                )
+            )
+        ).filter(has_tags=True)
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
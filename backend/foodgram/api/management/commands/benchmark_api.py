@@ -0,0 +1,212 @@
+import json
+import os
+import subprocess
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from rest_framework.authtoken.models import Token
+
+from api.urls import router, urlpatterns
+from recipe.models import Recipe
+
+User = get_user_model()
+
+SKIPPED_ROUTES = ('admin', 'token_cache_stats')
+
+
+def percentile(values, percent):
+    """Процентиль методом ближайшего ранга"""
+    ordered = sorted(values)
+    rank = max(0, int(round(percent / 100 * len(ordered))) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def supports_get(pattern):
+    return hasattr(getattr(pattern.callback, 'cls', None), 'get')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark API routes: latency percentiles, queries and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument(
+            '--user', default=None,
+            help='E-mail of the user to run requests as '
+                 '(the first user with recipes in cart by default).',
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help='Save results as JSON to this path.',
+        )
+        parser.add_argument(
+            '--compare', default=None,
+            help='Previous JSON results to compare with.',
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_AUTHORIZATION='Token {}'.format(token.key))
+
+        results = {}
+        for steps in self.collect_routes(user):
+            for key, result in self.measure(
+                    client, steps, options['iterations']).items():
+                results[key] = result
+                self.report(key, result)
+
+        data = {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'iterations': options['iterations'],
+            'routes': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(data, file, indent=2, ensure_ascii=False)
+        if options['compare']:
+            self.compare(data, options['compare'])
+
+    def get_user(self, email):
+        if email is not None:
+            return User.objects.get(email=email)
+        user = User.objects.filter(
+            cart_list__isnull=False
+        ).order_by('id').first() or User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('No users: run generate_fake_data first.')
+        return user
+
+    def collect_routes(self, user):
+        """Маршруты api.urls с подставленными значениями параметров.
+
+        Каждый маршрут - последовательность запросов одной итерации.
+        Связи с рецептом и автором (избранное, корзина, подписка)
+        проверяются парой POST + DELETE, данные остаются прежними
+        """
+        recipe = Recipe.objects.exclude(
+            fav_list__user=user
+        ).exclude(cart_list__user=user).order_by('id').first()
+        author = User.objects.exclude(pk=user.pk).exclude(
+            is_subscribed__user=user
+        ).order_by('id').first()
+        if recipe is None or author is None:
+            raise CommandError('Not enough data: run generate_fake_data.')
+        url_kwargs = {'recipe_id': recipe.pk, 'user_id': author.pk}
+
+        routes = []
+        for prefix, viewset, basename in router.registry:
+            list_kwargs = {
+                name: value for name, value in url_kwargs.items()
+                if '(?P<{}>'.format(name) in prefix
+            }
+            if list_kwargs:
+                url = reverse(basename + '-list', kwargs=list_kwargs)
+                routes.append((('POST', url), ('DELETE', url)))
+                continue
+            routes.append((('GET', reverse(basename + '-list')), ))
+            obj = viewset.queryset.order_by('pk').first()
+            if obj is not None:
+                lookup = viewset.lookup_url_kwarg or viewset.lookup_field
+                routes.append((
+                    ('GET', reverse(
+                        basename + '-detail', kwargs={lookup: obj.pk}
+                    )),
+                ))
+
+        for pattern in urlpatterns:
+            if (isinstance(pattern, URLPattern) and pattern.name
+                    and pattern.name not in SKIPPED_ROUTES
+                    and supports_get(pattern)):
+                routes.append((('GET', reverse(pattern.name)), ))
+        return routes
+
+    def request(self, client, method, url):
+        response = getattr(client, method.lower())(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, client, steps, iterations):
+        timings = {step: [] for step in steps}
+        queries = {step: [] for step in steps}
+        statuses = {}
+        connection = connections['default']
+        # Прогревочная итерация: кэши, индекс ингредиентов, токен
+        for step in steps:
+            self.request(client, *step)
+        for _ in range(iterations):
+            for step in steps:
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = self.request(client, *step)
+                    timings[step].append(
+                        (time.perf_counter() - started) * 1000
+                    )
+                queries[step].append(len(context))
+                statuses[step] = response.status_code
+
+        results = {}
+        for step in steps:
+            # Память - отдельным прогоном: трассировка искажает время
+            tracemalloc.start()
+            self.request(client, *step)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results['{} {}'.format(*step)] = {
+                'status': statuses[step],
+                'p50_ms': round(percentile(timings[step], 50), 3),
+                'p95_ms': round(percentile(timings[step], 95), 3),
+                'p99_ms': round(percentile(timings[step], 99), 3),
+                'queries': max(queries[step]),
+                'peak_memory_kb': round(peak / 1024, 1),
+            }
+        return results
+
+    def report(self, key, result):
+        self.stdout.write(
+            '{:<60} {status:>3}  p50 {p50_ms:>8.2f}  p95 {p95_ms:>8.2f}  '
+            'p99 {p99_ms:>8.2f} ms  {queries:>3} queries  '
+            '{peak_memory_kb:>8.1f} KB'.format(key, **result)
+        )
+
+    def compare(self, data, path):
+        if not os.path.exists(path):
+            raise CommandError('No results to compare: {}'.format(path))
+        with open(path) as file:
+            previous = json.load(file)
+
+        self.stdout.write('\nCompared with {} ({}):'.format(
+            path, previous.get('commit')
+        ))
+        for key, result in data['routes'].items():
+            old = previous['routes'].get(key)
+            if old is None:
+                continue
+            self.stdout.write(
+                '{:<60} p95 {:+8.2f} ms  queries {:+d}  memory {:+.1f} KB'
+                .format(
+                    key,
+                    result['p95_ms'] - old['p95_ms'],
+                    result['queries'] - old['queries'],
+                    result['peak_memory_kb'] - old['peak_memory_kb'],
+                )
+            )
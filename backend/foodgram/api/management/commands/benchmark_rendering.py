@@ -0,0 +1,96 @@
+import gzip
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.middleware import brotli
+from api.pagination import RecipeCursorPagination
+from api.renderers import FastJSONRenderer, orjson
+from api.views import RecipeViewSet
+
+from .benchmark_api import percentile
+
+User = get_user_model()
+
+
+def timed(function, iterations):
+    """Медиана времени вызова (мс) и результат последнего вызова"""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return percentile(timings, 50), result
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare JSON renderers and compression for RecipeViewSet.list: '
+        'serialization time and bytes on the wire'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument(
+            '--limit', type=int, default=100,
+            help='Page size of the recipe list (at most {}).'.format(
+                RecipeCursorPagination.max_page_size
+            ),
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help='Save results as JSON to this path.',
+        )
+
+    def get_page_data(self, limit):
+        """Данные страницы списка рецептов - так, как их отдает
+        представление, до рендеринга.
+
+        Размер страницы через limit задается только в курсорном режиме
+        """
+        request = APIRequestFactory().get(
+            '/api/recipes/', {'pagination': 'cursor', 'limit': limit}
+        )
+        user = User.objects.order_by('id').first()
+        if user is not None:
+            force_authenticate(request, user=user)
+        view = RecipeViewSet.as_view({'get': 'list'})
+        return view(request).data
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        data = self.get_page_data(options['limit'])
+
+        results = {'orjson': orjson is not None, 'renderers': {}}
+        for name, renderer in (('stdlib', JSONRenderer()),
+                               ('fast', FastJSONRenderer())):
+            render_ms, body = timed(lambda: renderer.render(data), iterations)
+            entry = {'render_ms': round(render_ms, 3), 'bytes': len(body)}
+
+            gzip_ms, compressed = timed(
+                lambda: gzip.compress(body, 6), iterations
+            )
+            entry['gzip_ms'] = round(gzip_ms, 3)
+            entry['gzip_bytes'] = len(compressed)
+            if brotli is not None:
+                brotli_ms, compressed = timed(
+                    lambda: brotli.compress(
+                        body, quality=settings.COMPRESSION_BROTLI_QUALITY
+                    ),
+                    iterations
+                )
+                entry['brotli_ms'] = round(brotli_ms, 3)
+                entry['brotli_bytes'] = len(compressed)
+            results['renderers'][name] = entry
+            self.stdout.write('{:<8} {}'.format(name, ', '.join(
+                '{} {}'.format(key, value) for key, value in entry.items()
+            )))
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
@@ -0,0 +1,328 @@
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+from rest_framework.serializers import BaseSerializer
+
+from . import db_router
+from .cache import is_shared_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('api.instrumentation')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_local = threading.local()
+
+PLACEHOLDER_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+NUMBER = re.compile(r'\b\d+\b')
+WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """Нормализованный SQL: без значений и длины списков IN (...)"""
+    sql = PLACEHOLDER_LIST.sub('(...)', sql)
+    sql = NUMBER.sub('N', sql)
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+class RequestStats:
+    """Статистика запроса: SQL-запросы и время сериализации"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.serializing = False
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+def timed_serializer_data(data):
+    """Обертка BaseSerializer.data: учитывается только внешний вызов,
+    вложенные сериализаторы входят в его время
+    """
+
+    def wrapper(self):
+        stats = getattr(_local, 'stats', None)
+        if stats is None or stats.serializing:
+            return data(self)
+        stats.serializing = True
+        started = perf_counter()
+        try:
+            return data(self)
+        finally:
+            stats.serialization_time += perf_counter() - started
+            stats.serializing = False
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def get_view_name(view_func, request):
+    """Имя представления: RecipeViewSet.list, download_shop_cart"""
+    name = getattr(view_func, '__name__', repr(view_func))
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        name = '{}.{}'.format(
+            name, actions.get(request.method.lower(), request.method)
+        )
+    return name
+
+
+@contextmanager
+def collect_stats(stats):
+    """SQL-запросы и сериализация внутри блока учитываются в stats"""
+    _local.stats = stats
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            yield
+    finally:
+        _local.stats = None
+
+
+def server_timing(stats, total, note=None):
+    """Значение заголовка Server-Timing"""
+    return (
+        'db;dur={:.1f};desc="{} queries{}", '
+        'serialize;dur={:.1f}, total;dur={:.1f}'.format(
+            stats.db_time * 1000, stats.queries,
+            ' {}'.format(note) if note else '',
+            stats.serialization_time * 1000, total * 1000
+        )
+    )
+
+
+class QueryInstrumentationMiddleware:
+    """Инструментирование запросов (включается QUERY_INSTRUMENTATION).
+
+    Считает SQL-запросы, время в базе и время сериализации,
+    отдает их в заголовке Server-Timing, пишет в лог медленные запросы
+    и повторяющиеся запросы (вероятный N+1) с именем представления.
+    Выключенный middleware не подключается вовсе
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if not getattr(BaseSerializer.data.fget, 'instrumented', False):
+            BaseSerializer.data = property(
+                timed_serializer_data(BaseSerializer.data.fget)
+            )
+
+    def __call__(self, request):
+        stats = RequestStats()
+        started = perf_counter()
+        with collect_stats(stats):
+            response = self.get_response(request)
+
+        if response.streaming:
+            # Заголовки уходят до чтения потока: в них - только запросы
+            # до начала отдачи, полный отчет - в логе после ее окончания
+            response['Server-Timing'] = server_timing(
+                stats, perf_counter() - started, 'before streaming'
+            )
+            response.streaming_content = self.stream(
+                response.streaming_content, request, stats, started
+            )
+            return response
+
+        total = perf_counter() - started
+        response['Server-Timing'] = server_timing(stats, total)
+        self.report(request, stats, total)
+        return response
+
+    def stream(self, content, request, stats, started):
+        """Потоковый ответ: запросы, выполненные при его чтении,
+        тоже учитываются; отчет - после последнего фрагмента
+        """
+        content = iter(content)
+        try:
+            while True:
+                with collect_stats(stats):
+                    chunk = next(content, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self.report(request, stats, perf_counter() - started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumented_view = get_view_name(view_func, request)
+
+    def report(self, request, stats, total):
+        view = getattr(request, 'instrumented_view', request.path)
+
+        for sql, times in stats.fingerprints.most_common():
+            if times <= settings.QUERY_INSTRUMENTATION_REPEAT_THRESHOLD:
+                break
+            logger.warning(
+                'Possible N+1 in %s: query executed %d times: %s',
+                view, times, sql
+            )
+
+        if (total * 1000 > settings.QUERY_INSTRUMENTATION_SLOW_MS
+                or stats.queries > settings.QUERY_INSTRUMENTATION_MAX_QUERIES):
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms total, %d queries '
+                'in %.1f ms, serialization %.1f ms',
+                request.method, request.get_full_path(), view,
+                total * 1000, stats.queries, stats.db_time * 1000,
+                stats.serialization_time * 1000
+            )
+
+
+class ReplicaPinningMiddleware:
+    """Разметка запросов для ReplicaRouter.
+
+    Безопасные запросы читают с реплик, если клиент не записывал
+    данные последние REPLICA_PIN_SECONDS секунд. Запрос с записью
+    закрепляет клиента (по токену или сессии) за основной базой,
+    чтобы он сразу видел свои изменения. Привязка хранится в кэше,
+    поэтому с репликами кэш должен быть общим для всех воркеров
+    """
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        if not is_shared_cache():
+            raise ImproperlyConfigured(
+                'Для реплик нужен общий кэш (CACHES): привязка клиента '
+                'к основной базе должна быть видна всем воркерам.'
+            )
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = db_router.get_pin_key(request)
+        db_router.start_request(
+            request.method in SAFE_METHODS and not db_router.is_pinned(key)
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            written = db_router.finish_request()
+        if written or request.method not in SAFE_METHODS:
+            db_router.pin(key)
+        return response
+
+
+def parse_accept_encoding(header):
+    """Accept-Encoding в словарь {кодировка: q}"""
+    encodings = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+def choose_encoding(header):
+    """Лучшая из поддерживаемых кодировок; brotli - при равном q"""
+    accepted = parse_accept_encoding(header)
+    supported = ('br', 'gzip') if brotli is not None else ('gzip', )
+    best, best_quality = None, 0.0
+    for encoding in supported:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def brotli_sequence(sequence):
+    compressor = brotli.Compressor(
+        quality=settings.COMPRESSION_BROTLI_QUALITY
+    )
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """Сжатие ответов brotli (если установлен) или gzip
+    по заголовку Accept-Encoding.
+
+    Сжимаются ответы не короче COMPRESSION_MIN_SIZE байт и потоковые
+    ответы; уже сжатые (с Content-Encoding) не трогаются
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding'):
+            return response
+        if (not response.streaming
+                and len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if encoding == 'br':
+                response.streaming_content = brotli_sequence(
+                    response.streaming_content
+                )
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content
+                )
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(
+                    response.content,
+                    quality=settings.COMPRESSION_BROTLI_QUALITY
+                )
+            else:
+                compressed = compress_string(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # Сжатое тело - другое представление: ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,49 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Курсорная пагинация ленты рецептов.
+
+    Позиция задается датой создания (id разрешает совпадения),
+    поэтому любая страница - это выборка по индексу без OFFSET и COUNT
+    """
+    ordering = ('-creation_date', '-id')
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class RecipePagination(PageNumberPagination):
+    """Постраничная пагинация рецептов.
+
+    С параметром ?pagination=cursor (или при наличии курсора)
+    переключается на курсорную
+    """
+    cursor_pagination_class = RecipeCursorPagination
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return (
+            request.query_params.get('pagination') == 'cursor'
+            or self.cursor_pagination_class.cursor_query_param
+            in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class TimelineCursorPagination(CursorPagination):
+    """Курсорная пагинация ленты подписок"""
+    ordering = ('-creation_date', '-id')
+    page_size_query_param = 'limit'
+    max_page_size = 100
@@ -0,0 +1,61 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class PlainTextRenderer(BaseRenderer):
+    """Рендерер простого текста.
+
+    Используется для выгрузок, которые отдаются потоковым ответом:
+    сам рендерер нужен для выбора формата через ?format=
+    и для отображения ошибок
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, bytes):
+            return data
+        return str(data).encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    """Рендерер csv"""
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSON через orjson, если он установлен, иначе - как JSONRenderer.
+
+    Типы, которых orjson не знает (Decimal, ленивые строки и т.п.),
+    передаются кодировщику DRF. Отступы (browsable API, ?indent)
+    и ошибки orjson обрабатывает стандартный рендерер
+    """
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.get_indent(
+                accepted_media_type or '', renderer_context or {})):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        try:
+            return orjson.dumps(
+                data,
+                default=self.encoder.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z,
+            )
+        except TypeError:
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
@@ -1,16 +1,77 @@
 import base64
+from collections import OrderedDict
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
+from django.db import transaction
 from rest_framework import serializers, status
+from rest_framework.permissions import SAFE_METHODS
 
 from recipe.models import (Favorites, Ingredient, IngredientAmount, Recipe,
                            ShoppingCart, Subscription, Tag)
+from recipe.shopping_list import (change_recipe_amounts,
+                                  delete_recipe_ingredients)
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+def split_field_names(value):
+    """Имена полей из параметра запроса: через запятую"""
+    if not value:
+        return set()
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetMixin:
+    """Поля ответа по параметрам ?fields= и ?omit= (через запятую).
+
+    Применяется к корневому сериализатору запросов на чтение,
+    вложенные сериализаторы отдают все свои поля. Неизвестные
+    имена игнорируются; если в итоге не остается ни одного поля,
+    отдаются все
+    """
+
+    @classmethod
+    def get_readable_fields(cls):
+        """Поля, которые вообще попадают в ответ"""
+        extra_kwargs = getattr(cls.Meta, 'extra_kwargs', {})
+        return {
+            name for name in cls.Meta.fields
+            if not extra_kwargs.get(name, {}).get('write_only')
+        }
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """Имена полей, которые нужно отдать в ответ на запрос:
+        по ним же представления решают, что загружать из базы
+        """
+        if request is None or request.method not in SAFE_METHODS:
+            return set(cls.Meta.fields)
+        readable = cls.get_readable_fields()
+        requested = split_field_names(
+            request.query_params.get('fields')
+        ) & readable
+        names = (requested or readable) - split_field_names(
+            request.query_params.get('omit')
+        )
+        return names or readable
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return fields
+
+        names = self.get_requested_fields(self.context.get('request'))
+        return OrderedDict(
+            (name, field) for name, field in fields.items() if name in names
+        )
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Сериализатор собственного класса пользователя"""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -32,6 +93,10 @@ class UserSerializer(serializers.ModelSerializer):
         на запрашиваемого пользователя
         """
 
+        is_followed = getattr(obj, 'is_followed', None)
+        if is_followed is not None:
+            return is_followed
+
         if hasattr(self.context['request'], 'user'):
             user = self.context['request'].user
         else:
@@ -39,7 +104,7 @@ class UserSerializer(serializers.ModelSerializer):
 
         if (user is None or not user.is_authenticated):
             return False
-        return (user.subscriber.filter(to_follow=obj).count() > 0)
+        return user.subscriber.filter(to_follow=obj).exists()
 
     def create(self, validated_data):
         """Переопределение создания пользователя
@@ -107,7 +172,7 @@ class Base64ImageField(serializers.ImageField):
         return super(Base64ImageField, self).to_internal_value(data)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Сериализатор рецепта"""
     author = UserSerializer(read_only=True)
     tags = serializers.PrimaryKeyRelatedField(
@@ -119,6 +184,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         source='ingredient_in_recipe_amount'
     )
     image = Base64ImageField()
+    images = serializers.SerializerMethodField()
     name = serializers.CharField(max_length=200)
     cooking_time = serializers.IntegerField(min_value=1)
 
@@ -142,10 +208,28 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'tags', 'author', 'ingredients',
             'is_favorited', 'is_in_shopping_cart',
-            'name', 'image', 'text', 'cooking_time')
+            'name', 'image', 'text', 'cooking_time', 'images')
         read_only_fields = ['id', 'author',
                             'is_favorited', 'is_in_shopping_cart']
 
+    def validate_ingredients(self, value):
+        """Все ингредиенты проверяются одним запросом"""
+        ids = [ing['ingredient']['id'] for ing in value]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться.'
+            )
+        found = set(
+            Ingredient.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        missing = [ing_id for ing_id in ids if ing_id not in found]
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: {}.'.format(missing)
+            )
+        return value
+
+    @transaction.atomic
     def create(self, validated_data):
         """Переопределенный класс создания:
         вложенные сериализаторы требуют обработки
@@ -155,52 +239,79 @@ class RecipeSerializer(serializers.ModelSerializer):
         ingredient_list = validated_data.pop('ingredient_in_recipe_amount')
         instance = super().create(validated_data)
 
-        for tag in tags_list:
-            instance.tags.add(tag)
-        for ing in ingredient_list:
-            ing_am = IngredientAmount(
+        instance.tags.set(tags_list)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
                 recipe=instance,
-                ingredient=Ingredient.objects.get(
-                    id=ing.get('ingredient').get('id')
-                ),
-                amount=ing.get('amount')
+                ingredient_id=ing['ingredient']['id'],
+                amount=ing['amount']
             )
-            ing_am.save()
+            for ing in ingredient_list
+        )
         return instance
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Переопределенный класс обновления:
         вложенные сериализаторы требуют отдельного обновления
         """
 
-        tags_list = validated_data.pop('tags')
-        ingredient_list = validated_data.pop('ingredient_in_recipe_amount')
+        tags_list = validated_data.pop('tags', None)
+        ingredient_list = validated_data.pop(
+            'ingredient_in_recipe_amount', None
+        )
         instance = super().update(instance, validated_data)
 
-        existing_tags = instance.tags.all()
-        for tag in existing_tags:
-            if tag not in tags_list:
-                instance.tags.remove(tag)
-        for tag in tags_list:
-            if tag not in existing_tags:
-                instance.tags.add(tag)
-
-        existing_ing = instance.ingredients.all()
-        for ing in existing_ing:
-            if ing not in ingredient_list:
-                IngredientAmount.objects.get(
-                    recipe=instance,
-                    ingredient=ing
-                ).delete()
-        for ing in ingredient_list:
-            ing_am, _ = IngredientAmount.objects.get_or_create(
+        if tags_list is not None:
+            instance.tags.set(tags_list)
+        if ingredient_list is not None:
+            self.update_ingredients(instance, ingredient_list)
+        return instance
+
+    def update_ingredients(self, instance, ingredient_list):
+        """Обновление количеств ингредиентов рецепта
+        фиксированным числом запросов: удаление убранных,
+        изменение измененных и добавление новых - пакетами
+        """
+        amounts = {
+            ing['ingredient']['id']: ing['amount'] for ing in ingredient_list
+        }
+        existing = {
+            ing_am.ingredient_id: ing_am
+            for ing_am in instance.ingredient_in_recipe_amount.all()
+        }
+
+        # Удаленные, измененные и новые строки правят списки покупок
+        # одной общей дельтой в конце
+        deltas = {
+            ing_id: -ing_am.amount for ing_id, ing_am in existing.items()
+            if ing_id not in amounts
+        }
+        delete_recipe_ingredients(instance.pk, deltas)
+
+        changed = []
+        for ing_id, ing_am in existing.items():
+            if ing_id in amounts and ing_am.amount != amounts[ing_id]:
+                deltas[ing_id] = amounts[ing_id] - ing_am.amount
+                ing_am.amount = amounts[ing_id]
+                changed.append(ing_am)
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ['amount'])
+
+        added = {
+            ing_id: amount for ing_id, amount in amounts.items()
+            if ing_id not in existing
+        }
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
                 recipe=instance,
-                ingredient=Ingredient.objects.get(
-                    id=ing.get('ingredient').get('id')
-                ),
-                amount=ing.get('amount')
+                ingredient_id=ing_id,
+                amount=amount
             )
-        return instance
+            for ing_id, amount in added.items()
+        )
+        deltas.update(added)
+        change_recipe_amounts(instance.pk, deltas)
 
     def to_representation(self, instance):
         """Переопределенный класс отображения:
@@ -208,33 +319,61 @@ class RecipeSerializer(serializers.ModelSerializer):
         """
 
         response = super().to_representation(instance)
-        tag_list = []
-        for tag in instance.tags.all():
-            tag_list.append(TagSerializer(tag).data)
-        response['tags'] = tag_list
+        fields = self.fields
+        if 'tags' in fields:
+            response['tags'] = TagSerializer(
+                instance.tags.all(), many=True
+            ).data
+
+        # В списках - уменьшенная копия для карточки
+        if 'image' in fields:
+            if isinstance(self.parent, serializers.ListSerializer):
+                response['image'] = instance.get_image_url('image_card')
+            else:
+                response['image'] = instance.get_image_url()
+
+        for flag_name, related_name in (('is_favorited', 'fav_list'),
+                                        ('is_in_shopping_cart', 'cart_list')):
+            if flag_name in fields:
+                response[flag_name] = self.get_user_flag(
+                    instance, flag_name, related_name
+                )
 
-        response['image'] = instance.image.url
+        return response
 
-        user = self.context['request'].user
+    def get_images(self, obj):
+        return {
+            'card': obj.get_image_url('image_card'),
+            'retina': obj.get_image_url('image_retina'),
+            'detail': obj.get_image_url('image_detail'),
+        }
 
-        if (not user.is_authenticated):
-            response['is_favorited'] = False
-            response['is_in_shopping_cart'] = False
-        else:
-            response['is_favorited'] = user.fav_list.filter(
-                recipe=instance).count() > 0
-            response['is_in_shopping_cart'] = user.cart_list.filter(
-                recipe=instance).count() > 0
+    def get_user_flag(self, instance, flag_name, related_name):
+        """Флаг рецепта для текущего пользователя:
+        берется из аннотации выборки, а при ее отсутствии
+        (например, сразу после создания) - отдельным запросом
+        """
+        flag = getattr(instance, flag_name, None)
+        if flag is not None:
+            return bool(flag)
 
-        return response
+        user = self.context['request'].user
+        if (not user.is_authenticated):
+            return False
+        return getattr(user, related_name).filter(recipe=instance).exists()
 
 
 class RecipeShortenedToDisplaySerializer(serializers.ModelSerializer):
     """Упрощенный сериализатор рецепта для отображения"""
+    image = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
+    def get_image(self, obj):
+        return obj.get_image_url('image_card')
+
 
 class SubscriptionListToDisplaySerializer(UserSerializer):
     """Сериализатор списка подписок"""
@@ -262,17 +401,22 @@ class SubscriptionListToDisplaySerializer(UserSerializer):
         lim = self.context.get('recipes_limit')
 
         response = super().to_representation(instance)
-        response['articles_count'] = instance.user_recipes.all().count()
 
-        recipe_list = []
+        if 'recipes_count' in self.fields:
+            response['articles_count'] = instance.recipes_count
+
+        if 'recipes' not in self.fields:
+            return response
 
-        if lim is not None:
+        # Рецепты заранее подготовлены для страницы подписок,
+        # отдельный запрос - только для одиночного автора
+        recipe_set = getattr(instance, 'page_recipes', None)
+        if recipe_set is None:
             recipe_set = instance.user_recipes.all()[:lim]
-        else:
-            recipe_set = instance.user_recipes.all()
-        for recipe in recipe_set:
-            recipe_list.append(RecipeShortenedToDisplaySerializer(recipe).data)
-        response['recipes'] = recipe_list
+        response['recipes'] = RecipeShortenedToDisplaySerializer(
+            recipe_set,
+            many=True
+        ).data
 
         return response
 
@@ -289,12 +433,6 @@ class SubscriptionSerializer(serializers.ModelSerializer):
                 'Вы не можете подписаться сами на себя.',
                 status.HTTP_400_BAD_REQUEST
             )
-        if (data['user'].subscriber.filter(
-                to_follow=data['to_follow']).count() > 0):
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя.',
-                status.HTTP_400_BAD_REQUEST
-            )
         return data
 
     def to_representation(self, instance):
@@ -314,16 +452,6 @@ class FavoritesSerializer(serializers.ModelSerializer):
         model = Favorites
         fields = '__all__'
 
-    def validate(self, data):
-        """Переопределен для проверки на уникальность"""
-        if (data['user'].fav_list.filter(
-                recipe=data['recipe']).count() > 0):
-            raise serializers.ValidationError(
-                'Вы уже добавили этот рецепт в избранное.',
-                status.HTTP_400_BAD_REQUEST
-            )
-        return data
-
     def to_representation(self, instance):
         """Переопределенный класс отображения"""
         return RecipeShortenedToDisplaySerializer(instance.recipe).data
@@ -335,16 +463,15 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         model = ShoppingCart
         fields = '__all__'
 
-    def validate(self, data):
-        """Переопределен для проверки на уникальность"""
-        if (data['user'].cart_list.filter(
-                recipe=data['recipe']).count() > 0):
-            raise serializers.ValidationError(
-                'Вы уже добавили этот рецепт в корзину.',
-                status.HTTP_400_BAD_REQUEST
-            )
-        return data
-
     def to_representation(self, instance):
         """Переопределенный класс отображения"""
         return RecipeShortenedToDisplaySerializer(instance.recipe).data
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для пакетных операций"""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RELATIONS_MAX_ITEMS,
+    )
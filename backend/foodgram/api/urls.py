@@ -2,15 +2,18 @@ from django.contrib import admin
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import (FavoritesViewSet, IngredientViewSet, RecipeViewSet,
-                    ShoppingCartViewSet, SubscriptionViewSet, TagViewSet,
-                    download_shop_cart, subscriptions)
+from .views import (FavoritesBulkView, FavoritesViewSet, IngredientViewSet,
+                    RecipeViewSet, ShoppingCartBulkView, ShoppingCartViewSet,
+                    SubscriptionBulkView, SubscriptionViewSet, TagViewSet,
+                    UserViewSet, download_shop_cart, feed, shopping_list,
+                    subscriptions, token_cache_stats)
 
 router = DefaultRouter()
 
 router.register('tags', TagViewSet, basename='tags')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('recipes', RecipeViewSet, basename='recipes')
+router.register('users', UserViewSet, basename='users')
 
 router.register(
     r'recipes\/(?P<recipe_id>\d+)\/shopping_cart',
@@ -31,12 +34,33 @@ router.register(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/subscriptions/', subscriptions, name='subscriptions'),
+    path('users/feed/', feed, name='feed'),
     path(
         'recipes/download_shopping_cart/',
         download_shop_cart,
         name='donwload_shop_cart'
     ),
-    path('', include('djoser.urls')),
+    path('recipes/shopping_list/', shopping_list, name='shopping_list'),
+    path(
+        'recipes/shopping_cart/bulk/',
+        ShoppingCartBulkView.as_view(),
+        name='shopping_cart_bulk'
+    ),
+    path(
+        'recipes/favorite/bulk/',
+        FavoritesBulkView.as_view(),
+        name='favorite_bulk'
+    ),
+    path(
+        'users/subscribe/bulk/',
+        SubscriptionBulkView.as_view(),
+        name='subscribe_bulk'
+    ),
+    path(
+        'auth/token/cache-stats/',
+        token_cache_stats,
+        name='token_cache_stats'
+    ),
     path('auth/', include('djoser.urls.authtoken')),
     path('', include(router.urls))
 ]
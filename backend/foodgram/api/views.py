@@ -1,57 +1,135 @@
 import csv
+import json
+from collections import defaultdict
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
 from django_filters import rest_framework as filters
-from rest_framework.decorators import action, api_view, permission_classes
+from djoser.views import UserViewSet as DjoserUserViewSet
+from rest_framework.decorators import (action, api_view, permission_classes,
+                                       renderer_classes)
 from rest_framework.filters import SearchFilter
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from recipe.models import (Favorites, Ingredient, Recipe, ShoppingCart,
-                           Subscription, Tag)
+from recipe.models import (DeletedRecipe, Favorites, Ingredient, Recipe,
+                           ShoppingCart, Subscription, Tag)
+from recipe.shopping_list import get_shopping_list
 
-from .filters import IngredientFilter
+from .authentication import token_cache
+from .autocomplete import ingredient_index
+from .filters import IngredientFilter, RecipeFilter
+from .pagination import RecipePagination, TimelineCursorPagination
 from .permissions import IsAdmin, IsAuthenticated, IsAuthor, ReadOnly
+from .renderers import CSVRenderer, FastJSONRenderer, PlainTextRenderer
 from .serializers import (FavoritesSerializer, IngredientSerializer,
                           RecipeSerializer, ShoppingCartSerializer,
                           SubscriptionListToDisplaySerializer,
-                          SubscriptionSerializer, TagSerializer)
-from .viewsets import URLParamNOPayloadViewSet
+                          SubscriptionSerializer, TagSerializer,
+                          UserSerializer)
+from .viewsets import (BulkRelationView, ConditionalGetMixin,
+                       PrerenderedListMixin, URLParamNOPayloadViewSet)
+
+User = get_user_model()
+
+
+class Echo:
+    """Псевдо-буфер: csv.writer отдает строку, а не пишет ее в файл"""
+
+    def write(self, value):
+        return value
+
+
+def shop_list_to_csv(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(
+            [row['name'], row['amount'], row['measurement_unit']]
+        )
+
+
+def shop_list_to_txt(rows):
+    for row in rows:
+        yield '{} ({}) — {}\n'.format(
+            row['name'], row['measurement_unit'], row['amount']
+        )
+
+
+def shop_list_to_json(rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(row, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+SHOP_LIST_WRITERS = {
+    'csv': shop_list_to_csv,
+    'txt': shop_list_to_txt,
+    'json': shop_list_to_json,
+}
+
+
+def get_shop_list(user):
+    """Список покупок из готовой таблицы: суммы ингредиентов
+    поддерживаются при изменении корзины и рецептов
+    """
+    for row in get_shopping_list(user).iterator():
+        yield {
+            'name': row['ingredient__name'],
+            'measurement_unit': row['ingredient__measurement_unit'],
+            'amount': row['amount'],
+        }
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes([CSVRenderer, PlainTextRenderer, FastJSONRenderer])
 def download_shop_cart(request):
-    """Метод для скачивания списка покупок"""
-
-    # Собираем все ингредиенты со всех рецептов в корзине
-    shop_list = []
-    shop_cart_list = request.user.cart_list.all()
-    for obj in shop_cart_list:
-        for ing_a in obj.recipe.ingredient_in_recipe_amount.all():
-            shop_list.append((ing_a.ingredient.id, ing_a.amount))
-
-    # Суммируем по каждому ингредиенту
-    ingredient_list = {x: 0 for x, _ in shop_list}
-    for ing, amount in shop_list:
-        ingredient_list[ing] += amount
-
-    # Готовим заголовок ответа
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="shoppinglist.csv"'
-
-    csv_writer = csv.writer(response)
-
-    # Пишем нужную информацию в файл
-    for ing_id, amount in ingredient_list.items():
-        ingredient = Ingredient.objects.get(id=ing_id)
-        csv_writer.writerow(
-            [ingredient.name, amount, ingredient.measurement_unit]
-        )
+    """Метод для скачивания списка покупок.
 
+    Формат выбирается параметром ?format= (csv, txt, json),
+    по умолчанию - csv
+    """
+    renderer = request.accepted_renderer
+    writer = SHOP_LIST_WRITERS[renderer.format]
+
+    response = StreamingHttpResponse(
+        writer(get_shop_list(request.user)),
+        content_type='{}; charset=utf-8'.format(renderer.media_type)
+    )
+    response['Content-Disposition'] = (
+        'attachment; filename="shoppinglist.{}"'.format(renderer.format)
+    )
     return response
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def shopping_list(request):
+    """Список покупок в JSON для отображения в интерфейсе"""
+    return Response(list(get_shop_list(request.user)))
+
+
+def attach_page_recipes(authors, recipes_limit):
+    """Рецепты всех авторов страницы - одним запросом"""
+    recipes = Recipe.objects.filter(
+        author__in=[author.id for author in authors]
+    )
+    if recipes_limit is not None:
+        recipes = recipes.latest_per_author(recipes_limit)
+    recipes_by_author = defaultdict(list)
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    for author in authors:
+        author.page_recipes = recipes_by_author[author.id]
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def subscriptions(request):
@@ -60,25 +138,78 @@ def subscriptions(request):
     Возвращает список подписок
     """
     user = request.user
-    recipes_limit = int(request.query_params.get('recipes_limit'))
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        recipes_limit = None
 
-    subscription_list = []
-    for sub in user.subscriber.all():
-        subscription_list.append(sub.to_follow)
+    authors = User.objects.filter(
+        is_subscribed__user=user
+    ).order_by('is_subscribed__id')
 
     paginator = PageNumberPagination()
-    paginator.paginate_queryset(subscription_list, request)
+    page = paginator.paginate_queryset(authors, request)
+    fields = SubscriptionListToDisplaySerializer.get_requested_fields(request)
+    if 'recipes' in fields:
+        attach_page_recipes(page, recipes_limit)
 
     serializer = SubscriptionListToDisplaySerializer(
-        instance=subscription_list,
+        instance=page,
         many=True,
-        context={'recipes_limit': recipes_limit}
+        context={'request': request, 'recipes_limit': recipes_limit}
     )
 
     return paginator.get_paginated_response(serializer.data)
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def feed(request):
+    """Лента рецептов авторов, на которых подписан пользователь.
+
+    Читается из заранее заполненной ленты пользователя
+    курсорной пагинацией: стоимость зависит только от размера страницы
+    """
+    paginator = TimelineCursorPagination()
+    entries = paginator.paginate_queryset(
+        request.user.timeline.only(
+            'id', 'user_id', 'recipe_id', 'creation_date'
+        ),
+        request
+    )
+    recipes = Recipe.objects.for_display(
+        request.user, RecipeSerializer.get_requested_fields(request)
+    ).in_bulk(
+        [entry.recipe_id for entry in entries]
+    )
+
+    serializer = RecipeSerializer(
+        [recipes[entry.recipe_id] for entry in entries],
+        many=True,
+        context={'request': request}
+    )
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def token_cache_stats(request):
+    """Счетчики кэша аутентификации текущего воркера"""
+    return Response(token_cache.stats())
+
+
+class UserViewSet(DjoserUserViewSet):
+    """Пользователи djoser с аннотацией подписки текущего пользователя"""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = UserSerializer.get_requested_fields(self.request)
+        if 'is_subscribed' not in fields:
+            return queryset
+        return queryset.with_is_followed(self.request.user)
+
+
+class TagViewSet(PrerenderedListMixin, ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = [
@@ -87,9 +218,10 @@ class TagViewSet(ReadOnlyModelViewSet):
     filter_backends = [SearchFilter]
     search_fields = ('name', )
     pagination_class = None
+    list_cache_key = 'reference:tags'
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(PrerenderedListMixin, ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     permission_classes = [
@@ -100,42 +232,79 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     filter_backends = [filters.DjangoFilterBackend, ]
     filterset_class = IngredientFilter
     filterset_fields = ('name', )
+    list_cache_key = 'reference:ingredients'
+
+    def list(self, request, *args, **kwargs):
+        """Поиск по имени идет по индексу в памяти:
+        сначала совпадения по началу имени, затем по подстроке
+        """
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        return Response(ingredient_index.search(name, limit))
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, ModelViewSet):
     serializer_class = RecipeSerializer
     queryset = Recipe.objects.all()
     permission_classes = [
         IsAuthenticated & (IsAuthor | IsAdmin) | ReadOnly
     ]
-    pagination_class = PageNumberPagination
-    search_fields = ('name', )
+    pagination_class = RecipePagination
+    filter_backends = [filters.DjangoFilterBackend, ]
+    filterset_class = RecipeFilter
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        self.reload_for_display(serializer)
 
-    def get_queryset(self):
-        queryset = Recipe.objects.all()
-        user = self.request.user
-
-        show_favorite = self.request.query_params.get('is_favorited')
-        show_shop = self.request.query_params.get('is_in_shopping_cart')
-        show_by_author = self.request.query_params.get('author')
-        show_by_tag = self.request.GET.getlist('tags')
-
-        if show_favorite is not None:
-            return queryset.filter(fav_list__user=user)
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.reload_for_display(serializer)
 
-        if show_shop is not None:
-            return queryset.filter(cart_list__user=user)
+    def reload_for_display(self, serializer):
+        """Сохраненный рецепт перечитывается со всеми связями разом,
+        чтобы ответ не собирался запросами по каждому ингредиенту
+        """
+        serializer.instance = Recipe.objects.for_display(
+            self.request.user
+        ).get(pk=serializer.instance.pk)
 
-        if show_by_author is not None:
-            return queryset.filter(author=show_by_author)
+    def get_queryset(self):
+        return Recipe.objects.for_display(
+            self.request.user,
+            self.get_serializer_class().get_requested_fields(self.request)
+        )
 
-        if show_by_tag:
-            return queryset.filter(tags__slug__in=show_by_tag).distinct()
+    def get_freshness_subqueries(self, queryset):
+        """Кроме изменений рецептов ответ зависит от их удалений,
+        а также от избранного, корзины и подписок пользователя:
+        их состояние меняется вместе с количеством и последним id
+        записей. Все подзапросы идут по индексам
+        """
+        subqueries = super().get_freshness_subqueries(queryset)
+        subqueries['deleted'] = DeletedRecipe.objects.order_by(
+            '-id'
+        ).values('id')[:1]
+        user = self.request.user
+        if not user.is_authenticated:
+            return subqueries
 
-        return super().get_queryset()
+        for name, related in (('favorites', user.fav_list),
+                              ('cart', user.cart_list),
+                              ('subscriptions', user.subscriber)):
+            state = related.order_by().values('user').annotate(
+                total=Count('id'),
+                last=Max('id')
+            )
+            subqueries[name + '_total'] = state.values('total')
+            subqueries[name + '_last'] = state.values('last')
+        return subqueries
 
 
 class SubscriptionViewSet(URLParamNOPayloadViewSet):
@@ -144,6 +313,7 @@ class SubscriptionViewSet(URLParamNOPayloadViewSet):
     permission_classes = [
         IsAuthenticated | IsAdmin | ReadOnly
     ]
+    duplicate_message = 'Вы уже подписаны на этого пользователя.'
     pagination_class = PageNumberPagination
 
     def create(self, *args, **kwargs):
@@ -158,9 +328,7 @@ class SubscriptionViewSet(URLParamNOPayloadViewSet):
 
     @action(methods=['delete'], detail=False)
     def delete(self, request, user_id=None):
-        return self.delete_special(
-            request.user.subscriber.filter(to_follow=user_id)
-        )
+        return self.delete_special(user_id)
 
 
 class ShoppingCartViewSet(URLParamNOPayloadViewSet):
@@ -169,6 +337,7 @@ class ShoppingCartViewSet(URLParamNOPayloadViewSet):
     permission_classes = [
         IsAuthenticated | IsAdmin | ReadOnly
     ]
+    duplicate_message = 'Вы уже добавили этот рецепт в корзину.'
     pagination_class = None
 
     def create(self, *args, **kwargs):
@@ -183,9 +352,7 @@ class ShoppingCartViewSet(URLParamNOPayloadViewSet):
 
     @action(methods=['delete'], detail=False)
     def delete(self, request, recipe_id=None):
-        return self.delete_special(
-            request.user.cart_list.filter(recipe=recipe_id)
-        )
+        return self.delete_special(recipe_id)
 
 
 class FavoritesViewSet(URLParamNOPayloadViewSet):
@@ -194,6 +361,7 @@ class FavoritesViewSet(URLParamNOPayloadViewSet):
     permission_classes = [
         IsAuthenticated | IsAdmin | ReadOnly
     ]
+    duplicate_message = 'Вы уже добавили этот рецепт в избранное.'
     pagination_class = None
 
     def create(self, *args, **kwargs):
@@ -208,6 +376,22 @@ class FavoritesViewSet(URLParamNOPayloadViewSet):
 
     @action(methods=['delete'], detail=False)
     def delete(self, request, recipe_id=None):
-        return self.delete_special(
-            request.user.fav_list.filter(recipe=recipe_id)
-        )
+        return self.delete_special(recipe_id)
+
+
+class SubscriptionBulkView(BulkRelationView):
+    model = Subscription
+    target_model = User
+
+    def can_relate(self, user, pk):
+        return user.pk != pk
+
+
+class ShoppingCartBulkView(BulkRelationView):
+    model = ShoppingCart
+    target_model = Recipe
+
+
+class FavoritesBulkView(BulkRelationView):
+    model = Favorites
+    target_model = Recipe
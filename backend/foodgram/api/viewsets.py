@@ -1,12 +1,42 @@
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import parse_etags
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
+from recipe.relations import (RELATION_TARGETS, delete_relations,
+                              insert_relations, relation_changed)
+
+from .middleware import brotli, choose_encoding
+from .permissions import IsAuthenticated
+from .renderers import FastJSONRenderer
+from .serializers import BulkIdsSerializer
+
 
 class URLParamNOPayloadViewSet(CreateModelMixin,
                                DestroyModelMixin,
                                GenericViewSet):
+    """Связь пользователя с объектом из адресной строки.
+
+    Уникальность проверяет ограничение базы: создание - один INSERT,
+    нарушение ограничения превращается в 400. Удаление - один DELETE,
+    статус ответа определяется числом удаленных строк
+    """
+    duplicate_message = 'Объект уже существует.'
 
     def create_special(self, obj_name, obj_value, usr_value):
         """Метод переопределен:
@@ -28,6 +58,16 @@ class URLParamNOPayloadViewSet(CreateModelMixin,
             headers=headers
         )
 
+    def perform_create(self, serializer):
+        try:
+            with transaction.atomic():
+                serializer.save()
+        except IntegrityError:
+            # Тот же формат, что у ошибок validate() сериализатора
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [self.duplicate_message]
+            })
+
     def get_serializer(self, *args, **kwargs):
         """Метод переопределен:
         POST without payload,
@@ -44,18 +84,239 @@ class URLParamNOPayloadViewSet(CreateModelMixin,
         kwargs['data'] = draft_request_data
         return serializer_class(*args, **kwargs)
 
-    def delete_special(self, queryset):
-        if queryset.count() == 1:
-            queryset.first().delete()
-            return Response(
-                status=status.HTTP_204_NO_CONTENT
+    def delete_special(self, target_id):
+        model = self.get_queryset().model
+        with transaction.atomic():
+            # Одним DELETE без сигналов: зависимые данные - ниже
+            deleted = delete_relations(
+                model, self.request.user.pk, [int(target_id)]
             )
-        if queryset.count() == 0:
+            relation_changed(model, self.request.user.pk, deleted, -1)
+        if deleted:
             return Response(
-                'Ошибка удаления объекта: не найдено.',
-                status=status.HTTP_400_BAD_REQUEST
+                status=status.HTTP_204_NO_CONTENT
             )
         return Response(
-            'Ошибка удаления объекта: что-то пошло не так.',
+            'Ошибка удаления объекта: не найдено.',
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+class PrerenderedListMixin:
+    """Полный список (без параметров запроса) отдается из кэша:
+    готовый JSON, его сжатые варианты (gzip, br) и их ETag.
+    Кэш сбрасывается сигналами при изменении модели
+    """
+    list_cache_key = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        entry = cache.get(self.list_cache_key)
+        if entry is None:
+            entry = self.build_list_cache()
+
+        encoding = choose_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if encoding not in entry['bodies']:
+            encoding = None
+        etag = entry['etags'][encoding]
+
+        # Слабое сравнение, как в django.utils.cache:
+        # префикс W/ не мешает совпадению
+        if_none_match = {
+            tag[2:] if tag.startswith('W/') else tag
+            for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        }
+        if ('*' in if_none_match
+                or if_none_match & set(entry['etags'].values())):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                entry['bodies'][encoding],
+                content_type='application/json'
+            )
+            response['Content-Length'] = len(response.content)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+    def build_list_cache(self):
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        body = FastJSONRenderer().render(serializer.data)
+        bodies = {None: body, 'gzip': gzip.compress(body)}
+        if brotli is not None:
+            bodies['br'] = brotli.compress(
+                body, quality=settings.COMPRESSION_BROTLI_QUALITY
+            )
+
+        digest = hashlib.sha1(body).hexdigest()
+        entry = {
+            'bodies': bodies,
+            'etags': {
+                encoding: '"{}{}"'.format(
+                    digest, '-' + encoding if encoding else ''
+                )
+                for encoding in bodies
+            },
+        }
+        cache.set(
+            self.list_cache_key,
+            entry,
+            settings.REFERENCE_LIST_CACHE_TIMEOUT
+        )
+        return entry
+
+    @classmethod
+    def invalidate_list_cache(cls, **kwargs):
+        cache.delete(cls.list_cache_key)
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы для list и retrieve по ETag.
+
+    Состояние ответа читается одним запросом из скалярных подзапросов
+    по индексам: последнее изменение объектов и то, что добавляют
+    наследники (например, отметка последнего удаления). Last-Modified
+    не отдается: ответ зависит и от данных пользователя, которых
+    дата изменения объектов не отражает. Если клиент прислал
+    актуальный ETag, возвращается 304 до выборки данных и сериализации
+    """
+    last_modified_field = 'updated_at'
+
+    def get_freshness_queryset(self):
+        return self.get_queryset().model.objects.all()
+
+    def get_freshness_subqueries(self, queryset):
+        """Подзапросы состояния ответа: {имя: выборка одного значения}"""
+        return {
+            'last_modified': queryset.order_by(
+                '-' + self.last_modified_field
+            ).values(self.last_modified_field)[:1],
+        }
+
+    def get_validators(self, queryset):
+        subqueries = self.get_freshness_subqueries(queryset)
+        columns, params = [], []
+        for subquery in subqueries.values():
+            sql, subquery_params = subquery.query.sql_with_params()
+            columns.append('({})'.format(sql))
+            params.extend(subquery_params)
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute('SELECT ' + ', '.join(columns), params)
+            state = dict(zip(subqueries, cursor.fetchone()))
+
+        key = '{}|{}|{}'.format(
+            self.request.user.pk,
+            self.request.get_full_path(),
+            sorted(state.items())
+        )
+        return '"{}"'.format(hashlib.sha1(key.encode()).hexdigest())
+
+    def conditional_response(self, queryset, handler, *args, **kwargs):
+        etag = self.get_validators(queryset)
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            response = handler(self.request, *args, **kwargs)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Authorization', ))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_freshness_queryset(),
+            super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.get_freshness_queryset().filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, DjangoValidationError):
+            # Как get_object_or_404 в DRF: неверный ключ - это 404
+            raise Http404
+        return self.conditional_response(
+            queryset,
+            super().retrieve, *args, **kwargs
+        )
+
+
+class BulkRelationView(APIView):
+    """Пакетное добавление (POST) и удаление (DELETE) связей
+    пользователя с объектами по списку id: {"ids": [1, 2, 3]}.
+
+    Одна проверка существования, одна пакетная вставка или одно
+    удаление; зависимые данные (счетчики, список покупок, лента)
+    пересчитываются одним вызовом. В ответе - статус каждого id
+    """
+    model = None
+    target_model = None
+    permission_classes = [IsAuthenticated]
+
+    @property
+    def target_field(self):
+        return RELATION_TARGETS[self.model]
+
+    def get_ids(self, request):
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Порядок сохраняется, повторы отбрасываются
+        return list(dict.fromkeys(serializer.validated_data['ids']))
+
+    def can_relate(self, user, pk):
+        return True
+
+    def post(self, request):
+        ids = self.get_ids(request)
+        user = request.user
+        targets = dict(
+            self.target_model.objects.filter(pk__in=ids).annotate(
+                related=Exists(self.model.objects.filter(
+                    user=user, **{self.target_field: OuterRef('pk')}
+                ))
+            ).values_list('pk', 'related')
+        )
+
+        statuses = {}
+        for pk in ids:
+            if pk not in targets:
+                statuses[pk] = 'not_found'
+            elif targets[pk]:
+                statuses[pk] = 'exists'
+            elif not self.can_relate(user, pk):
+                statuses[pk] = 'forbidden'
+            else:
+                statuses[pk] = 'created'
+        candidates = [pk for pk in ids if statuses[pk] == 'created']
+
+        with transaction.atomic():
+            # Строки, вставленные между проверкой и вставкой
+            # конкурентным запросом, в created не попадают
+            created = insert_relations(self.model, user.pk, candidates)
+            relation_changed(self.model, user.pk, created)
+        for pk in set(candidates).difference(created):
+            statuses[pk] = 'exists'
+        return self.report(ids, statuses)
+
+    def delete(self, request):
+        ids = self.get_ids(request)
+        with transaction.atomic():
+            # Без сигналов: зависимые данные - ниже, одним вызовом
+            deleted = delete_relations(self.model, request.user.pk, ids)
+            relation_changed(self.model, request.user.pk, deleted, -1)
+        deleted = set(deleted)
+        return self.report(ids, {
+            pk: 'deleted' if pk in deleted else 'not_found' for pk in ids
+        })
+
+    def report(self, ids, statuses):
+        return Response({
+            'results': [{'id': pk, 'status': statuses[pk]} for pk in ids]
+        })
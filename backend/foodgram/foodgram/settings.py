@@ -32,12 +32,16 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'django_filters',
     'djoser',
+    'sorl.thumbnail',
     'api.apps.ApiConfig',
     'recipe.apps.RecipeConfig',
     'users.apps.UserConfig'
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryInstrumentationMiddleware',
+    'api.middleware.CompressionMiddleware',
+    'api.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,6 +87,35 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: адреса через запятую в DB_REPLICA_HOSTS.
+# В тестах реплики отражают основную базу
+for number, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES['replica_{}'.format(number)] = dict(
+        DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'}
+    )
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter']
+
+# Кэш Django. С несколькими воркерами нужен общий бэкенд
+# (например, django.core.cache.backends.db.DatabaseCache после
+# createcachetable): в нем привязка клиентов к основной базе
+# и кэш аутентификации. По умолчанию - память процесса
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Сколько секунд после записи клиент читает с основной базы
+REPLICA_PIN_SECONDS = 5
+# Интервал проверки доступности реплик, секунды
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -129,6 +162,9 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'backend_mediafiles')
 
 AUTH_USER_MODEL = 'users.User'
 
+# Качество JPEG для уменьшенных копий изображений рецептов
+RECIPE_IMAGE_QUALITY = 80
+
 EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 DEFAULT_FROM_EMAIL = 'admin@foodgram.to'
@@ -139,16 +175,50 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 6,
 }
 
+# Сжатие ответов: минимальный размер (байт) и качество brotli
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_BROTLI_QUALITY = 5
+
+# Инструментирование запросов: Server-Timing, медленные запросы и N+1.
+# Выключено по умолчанию, включается переменной окружения
+QUERY_INSTRUMENTATION = os.getenv('QUERY_INSTRUMENTATION') == 'True'
+QUERY_INSTRUMENTATION_SLOW_MS = 500
+QUERY_INSTRUMENTATION_MAX_QUERIES = 50
+QUERY_INSTRUMENTATION_REPEAT_THRESHOLD = 5
+
+# Автодополнение ингредиентов: размер выдачи по умолчанию
+# и время жизни индекса в памяти воркера (секунды)
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_INDEX_TTL = 300
+
+# Максимум id в одном пакетном запросе к избранному, корзине, подпискам
+BULK_RELATIONS_MAX_ITEMS = 100
+
+# Конфигурация полнотекстового поиска Postgres
+SEARCH_CONFIG = 'russian'
+
+# Время жизни готовых ответов справочников (теги, ингредиенты), секунды
+REFERENCE_LIST_CACHE_TIMEOUT = 300
+
+# Кэш аутентификации по токену: размер LRU в памяти воркера
+# и время жизни записи (секунды). Работает только с общим CACHES
+TOKEN_AUTH_CACHE_SIZE = 10000
+TOKEN_AUTH_CACHE_TTL = 60
+
 DJOSER = {
     'HIDE_USERS': False,
     'LOGIN_FIELD': 'email',
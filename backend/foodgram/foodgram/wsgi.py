@@ -5,3 +5,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+# Индекс автодополнения ингредиентов строится при старте воркера
+from api.autocomplete import ingredient_index  # noqa: E402
+
+ingredient_index.warm_up()
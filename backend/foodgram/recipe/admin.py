@@ -1,6 +1,4 @@
-from django import forms
 from django.contrib import admin
-from django.db import models
 
 from .models import (Favorites, Ingredient, IngredientAmount, Recipe,
                      ShoppingCart, Subscription, Tag)
@@ -9,50 +7,73 @@ from .models import (Favorites, Ingredient, IngredientAmount, Recipe,
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'slug', 'color')
+    search_fields = ('name', 'slug')
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'measurement_unit')
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
+    search_fields = ('name',)
+    show_full_result_count = False
 
 
 class IngredientInline(admin.TabularInline):
     model = Recipe.ingredients.through
+    autocomplete_fields = ('ingredient',)
+    extra = 0
+
+
+class TagInline(admin.TabularInline):
+    model = Recipe.tags.through
+    extra = 0
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    formfield_overrides = {
-        models.ManyToManyField: {'widget': forms.CheckboxSelectMultiple},
-    }
-
     list_display = ('id', 'name', 'author',
                     'image', 'text', 'cooking_time',
                     'in_favorites')
-    list_filter = ('name', 'author')
-    filter_horizontal = ('tags',)
-    inlines = [IngredientInline, ]
+    list_select_related = ('author',)
+    list_filter = ('tags',)
+    search_fields = ('name', 'author__email')
+    autocomplete_fields = ('author',)
+    inlines = [TagInline, IngredientInline, ]
+    show_full_result_count = False
 
     def in_favorites(self, obj):
-        return obj.fav_list.all().count()
+        return obj.favorites_count
+    in_favorites.admin_order_field = 'favorites_count'
+    in_favorites.short_description = 'в избранном'
 
 
 @admin.register(IngredientAmount)
 class IngredientAmountAdmin(admin.ModelAdmin):
     list_display = ('id', 'ingredient', 'recipe', 'amount')
+    list_select_related = ('ingredient', 'recipe')
+    autocomplete_fields = ('ingredient', 'recipe')
+    show_full_result_count = False
 
 
 @admin.register(Favorites)
 class FavoritesAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
 
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+    show_full_result_count = False
 
 
 @admin.register(Subscription)
 class SubscriptionCartAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'to_follow')
+    list_select_related = ('user', 'to_follow')
+    autocomplete_fields = ('user', 'to_follow')
+    show_full_result_count = False
@@ -0,0 +1,18 @@
+from collections import Counter
+
+from django.db.models import F
+
+
+def change_counter(model, field, pks, delta=1):
+    """Атомарное изменение счетчика: UPDATE ... SET field = field + delta.
+
+    pks может содержать повторы (например, при пакетном удалении
+    нескольких записей одного рецепта) - изменение для них суммируется
+    """
+    by_times = {}
+    for pk, times in Counter(pks).items():
+        by_times.setdefault(times, []).append(pk)
+    for times, group in by_times.items():
+        model.objects.filter(pk__in=group).update(
+            **{field: F(field) + delta * times}
+        )
@@ -0,0 +1,28 @@
+from django.conf import settings
+from sorl.thumbnail import get_thumbnail
+
+# Варианты изображения рецепта: поле модели -> параметры sorl-thumbnail
+IMAGE_VARIANTS = {
+    'image_card': {'geometry': '480x320', 'crop': 'center'},
+    'image_retina': {'geometry': '960x640', 'crop': 'center'},
+    'image_detail': {'geometry': '1280x1280', 'upscale': False},
+}
+
+
+def make_image_variants(image):
+    """Уменьшенные и пережатые копии изображения.
+
+    Возвращает имена файлов вариантов в хранилище
+    """
+    variants = {}
+    for field_name, options in IMAGE_VARIANTS.items():
+        options = dict(options)
+        thumbnail = get_thumbnail(
+            image,
+            options.pop('geometry'),
+            format='JPEG',
+            quality=settings.RECIPE_IMAGE_QUALITY,
+            **options
+        )
+        variants[field_name] = thumbnail.name
+    return variants
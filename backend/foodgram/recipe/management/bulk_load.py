@@ -0,0 +1,111 @@
+import json
+import os
+import re
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+CHUNK_SIZE = 64 * 1024
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
+    """Потоковое чтение JSON-массива:
+    в памяти держится только текущий фрагмент файла
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив.')
+    position = 1
+    eof = False
+
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        if position < len(buffer):
+            try:
+                obj, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # Значение в самом конце фрагмента может быть обрезано
+                if end < len(buffer) or eof:
+                    yield obj
+                    position = end
+                    continue
+        if eof:
+            raise CommandError('Неожиданный конец файла.')
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+class BulkLoadCommand(BaseCommand):
+    """Пакетная загрузка справочника из JSON-файла.
+
+    Строки, уже существующие в базе (по уникальным ограничениям модели),
+    пропускаются, поэтому повторный запуск не создает дубликатов
+    """
+    model = None
+    file_name = None
+    fields = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=os.path.join(settings.BASE_DIR, 'data/', self.file_name),
+            help='Path to the JSON file.',
+        )
+        parser.add_argument(
+            '--batch-size', dest='batch_size', type=int, default=1000,
+            help='Number of rows inserted per query.',
+        )
+
+    def build_object(self, data):
+        obj = self.model(**{field: data.get(field) for field in self.fields})
+        try:
+            obj.clean_fields()
+        except ValidationError as error:
+            self.stdout.write(
+                self.style.ERROR(
+                    'An error occurred while loading {}: {}'.format(
+                        data, error.message_dict
+                    )
+                )
+            )
+            return None
+        return obj
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        initial_count = self.model.objects.count()
+        processed = 0
+
+        with open(options['path'], 'r', encoding='utf-8') as file:
+            objects = filter(None, map(self.build_object,
+                                       iter_json_array(file)))
+            while True:
+                batch = list(islice(objects, options['batch_size']))
+                if not batch:
+                    break
+                self.model.objects.bulk_create(batch, ignore_conflicts=True)
+                processed += len(batch)
+
+        elapsed = time.monotonic() - started
+        created = self.model.objects.count() - initial_count
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Processed {} rows: {} added, {} skipped '
+                'in {:.2f}s ({:.0f} rows/s)'.format(
+                    processed, created, processed - created,
+                    elapsed, processed / elapsed if elapsed else processed
+                )
+            )
+        )
@@ -0,0 +1,197 @@
+import random
+import time
+import uuid
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.models import (Favorites, Ingredient, IngredientAmount, Recipe,
+                           RecipeTag, ShoppingCart, Subscription, Tag)
+
+User = get_user_model()
+
+WORDS = (
+    'суп', 'салат', 'пирог', 'каша', 'омлет', 'рагу', 'запеканка',
+    'блины', 'оладьи', 'котлеты', 'плов', 'паста', 'торт', 'кекс',
+    'домашний', 'быстрый', 'летний', 'острый', 'сливочный', 'овощной',
+)
+
+
+def zipf_weights(size):
+    """Веса популярности: немногие объекты встречаются часто"""
+    return [1 / rank for rank in range(1, size + 1)]
+
+
+class Command(BaseCommand):
+    help = 'Generate fake users, recipes, favorites, carts and subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Average number of favorites per user.',
+        )
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Average number of recipes in a shopping cart.',
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Average number of subscriptions per user.',
+        )
+        parser.add_argument(
+            '--batch-size', dest='batch_size', type=int, default=1000,
+        )
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--password', default='fake-password',
+            help='Password of every generated user.',
+        )
+
+    def bulk_create(self, model, objects, ignore_conflicts=False):
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, self.batch_size))
+            if not batch:
+                return
+            model.objects.bulk_create(
+                batch, ignore_conflicts=ignore_conflicts
+            )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        if not ingredient_ids or not tag_ids:
+            raise CommandError(
+                'Load ingredients and tags first '
+                '(load_ingredients, load_tags).'
+            )
+
+        user_ids = self.create_users(options['users'], options['password'])
+        recipes = self.create_recipes(options['recipes'], user_ids)
+        recipe_ids = [recipe_id for recipe_id, _ in recipes]
+        self.create_ingredients(recipe_ids, ingredient_ids)
+        self.create_tags(recipe_ids, tag_ids)
+        self.create_relations(
+            Favorites, 'recipe', user_ids, recipe_ids, options['favorites']
+        )
+        self.create_relations(
+            ShoppingCart, 'recipe', user_ids, recipe_ids, options['carts']
+        )
+        authors = sorted({author_id for _, author_id in recipes})
+        self.create_relations(
+            Subscription, 'to_follow', user_ids, authors,
+            options['subscriptions']
+        )
+
+        # Пакетная вставка не вызывает сигналы: счетчики, ленты,
+        # поисковый индекс и списки покупок - отдельно
+        call_command('recount', stdout=self.stdout)
+        call_command('rebuild_timeline', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Generated {} users and {} recipes in {:.1f}s'.format(
+                    len(user_ids), len(recipe_ids),
+                    time.monotonic() - started
+                )
+            )
+        )
+
+    def create_users(self, count, password):
+        run = uuid.uuid4().hex[:8]
+        last_id = User.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        password = make_password(password)
+        self.bulk_create(User, (
+            User(
+                email='fake-{}-{}@example.com'.format(run, number),
+                username='fake-{}-{}'.format(run, number),
+                first_name='Имя{}'.format(number),
+                last_name='Фамилия{}'.format(number),
+                password=password,
+            )
+            for number in range(count)
+        ))
+        return list(
+            User.objects.filter(id__gt=last_id).values_list('id', flat=True)
+        )
+
+    def create_recipes(self, count, user_ids):
+        last_id = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        # Небольшая часть авторов публикует большую часть рецептов
+        authors = self.random.choices(
+            user_ids, weights=zipf_weights(len(user_ids)), k=count
+        )
+        self.bulk_create(Recipe, (
+            Recipe(
+                author_id=author_id,
+                name=' '.join(self.random.sample(WORDS, 3)).capitalize(),
+                text=' '.join(self.random.choices(WORDS, k=60)),
+                cooking_time=self.random.randint(5, 180),
+            )
+            for author_id in authors
+        ))
+        return list(
+            Recipe.objects.filter(id__gt=last_id).values_list(
+                'id', 'author_id'
+            )
+        )
+
+    def create_ingredients(self, recipe_ids, ingredient_ids):
+        weights = zipf_weights(len(ingredient_ids))
+
+        def amounts():
+            for recipe_id in recipe_ids:
+                size = max(1, min(30, int(self.random.gauss(8, 3))))
+                chosen = set(self.random.choices(
+                    ingredient_ids, weights=weights, k=size
+                ))
+                for ingredient_id in chosen:
+                    yield IngredientAmount(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=self.random.randint(1, 500),
+                    )
+
+        self.bulk_create(IngredientAmount, amounts())
+
+    def create_tags(self, recipe_ids, tag_ids):
+        self.bulk_create(RecipeTag, (
+            RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.random.sample(
+                tag_ids, self.random.randint(1, min(3, len(tag_ids)))
+            )
+        ))
+
+    def create_relations(self, model, field, user_ids, target_ids, average):
+        """Связи пользователей с объектами: популярные объекты
+        выбираются чаще, повторы отбрасываются ограничениями
+        """
+        if not target_ids or not average:
+            return
+        weights = zipf_weights(len(target_ids))
+        self.bulk_create(model, (
+            model(user_id=user_id, **{field + '_id': target_id})
+            for user_id in user_ids
+            for target_id in set(self.random.choices(
+                target_ids,
+                weights=weights,
+                k=self.random.randint(0, average * 2)
+            ))
+            if target_id != user_id or field != 'to_follow'
+        ), ignore_conflicts=True)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Generate resized image variants for existing recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate variants even if the source image is unchanged.',
+        )
+
+    def handle(self, *args, **options):
+        updated = 0
+        for recipe in Recipe.objects.exclude(image='').iterator():
+            if recipe.update_image_variants(force=options['force']):
+                updated += 1
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Image variants generated for {} recipes'.format(updated)
+            )
+        )
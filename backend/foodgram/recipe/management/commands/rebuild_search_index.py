@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from recipe.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the recipe full-text search index'
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        self.stdout.write(
+            self.style.SUCCESS('Search index rebuilt: {} recipes'.format(
+                count
+            ))
+        )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from recipe.shopping_list import rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized shopping lists from shopping carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', dest='users', type=int, action='append',
+            help='Rebuild only the list of this user id (repeatable).',
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_shopping_lists(options['users'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Shopping lists rebuilt: {} rows'.format(count)
+            )
+        )
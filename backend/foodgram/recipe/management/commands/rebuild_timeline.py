@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipe.models import Subscription, TimelineEntry
+from recipe.timeline import backfill_timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild followed-authors timelines from subscriptions'
+
+    def handle(self, *args, **options):
+        subscriptions = Subscription.objects.values_list(
+            'user_id', 'to_follow_id'
+        )
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            for user_id, author_id in subscriptions.iterator():
+                backfill_timeline(user_id, [author_id])
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Timeline rebuilt: {} entries'.format(
+                    TimelineEntry.objects.count()
+                )
+            )
+        )
@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipe.models import Favorites, Recipe, ShoppingCart
+
+User = get_user_model()
+
+
+def count_subquery(model, field):
+    """Количество записей model, ссылающихся на внешнюю строку"""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized favorites, cart and recipe counters'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recipes = Recipe.objects.update(
+                favorites_count=count_subquery(Favorites, 'recipe'),
+                in_carts_count=count_subquery(ShoppingCart, 'recipe'),
+            )
+            users = User.objects.update(
+                recipes_count=count_subquery(Recipe, 'author'),
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                'Counters recalculated for {} recipes and {} users'.format(
+                    recipes, users
+                )
+            )
+        )
@@ -1,9 +1,21 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, Window)
+from django.db.models.functions import RowNumber
+from django.db.models.query import RawQuerySet
+
+from .images import IMAGE_VARIANTS, make_image_variants
 
 User = get_user_model()
 
+# GIN-индекс поискового вектора создается только в Postgres
+POSTGRES = 'postgresql' in settings.DATABASES['default']['ENGINE']
+
 
 class Tag(models.Model):
     name = models.TextField(
@@ -43,11 +55,92 @@ class Ingredient(models.Model):
         ordering = ['id']
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотации is_favorited и is_in_shopping_cart
+        для пользователя user
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                user.fav_list.filter(recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                user.cart_list.filter(recipe=OuterRef('pk'))
+            ),
+        )
+
+    def for_display(self, user, fields=None):
+        """Выборка рецептов для отображения пользователю user:
+        все связанные объекты загружаются заранее,
+        отображение не требует дополнительных запросов.
+
+        fields - отображаемые поля (None - все): связи, которых
+        среди них нет, не загружаются, текст не читается из базы
+        """
+        def shown(name):
+            return fields is None or name in fields
+
+        lookups = []
+        if shown('author'):
+            lookups.append(Prefetch(
+                'author',
+                queryset=User.objects.with_is_followed(user)
+            ))
+        if shown('tags'):
+            lookups.append('tags')
+        if shown('ingredients'):
+            lookups.append(Prefetch(
+                'ingredient_in_recipe_amount',
+                queryset=IngredientAmount.objects.select_related('ingredient')
+            ))
+        # Поисковый вектор для отображения не нужен никогда
+        deferred = ['search_vector'] + ([] if shown('text') else ['text'])
+
+        queryset = self.defer(*deferred).prefetch_related(*lookups)
+        if not (shown('is_favorited') or shown('is_in_shopping_cart')):
+            return queryset
+        return queryset.with_user_flags(user)
+
+    def latest_per_author(self, limit):
+        """Не более limit последних рецептов каждого автора выборки.
+
+        Один запрос: ROW_NUMBER() с разбиением по автору,
+        отбор по номеру строки - во внешнем запросе
+        """
+        queryset = self.annotate(
+            author_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author')],
+                order_by=[F('creation_date').desc(), F('id').desc()],
+            )
+        ).order_by()
+        sql, params = queryset.query.sql_with_params()
+        return RawQuerySet(
+            'SELECT * FROM ({}) ranked WHERE author_rank <= %s '
+            'ORDER BY author_id, author_rank'.format(sql),
+            model=self.model,
+            params=(*params, limit),
+            using=self.db,
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -65,6 +158,27 @@ class Recipe(models.Model):
         blank=True,
         verbose_name='изображение',
     )
+    image_card = models.ImageField(
+        blank=True,
+        editable=False,
+        verbose_name='изображение для карточки',
+    )
+    image_retina = models.ImageField(
+        blank=True,
+        editable=False,
+        verbose_name='изображение для карточки (retina)',
+    )
+    image_detail = models.ImageField(
+        blank=True,
+        editable=False,
+        verbose_name='изображение для страницы рецепта',
+    )
+    image_variants_source = models.CharField(
+        max_length=255,
+        blank=True,
+        editable=False,
+        verbose_name='исходник вариантов изображения',
+    )
     text = models.TextField(
         verbose_name='текст',)
     cooking_time = models.PositiveIntegerField(
@@ -81,21 +195,139 @@ class Recipe(models.Model):
 
     tags = models.ManyToManyField(
         Tag,
+        through='RecipeTag',
         related_name='recipes',
         blank=True,
         verbose_name='теги',
     )
 
     creation_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    favorites_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='в избранном',
+    )
+    in_carts_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='в корзинах',
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='поисковый вектор',
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-creation_date']
+        ordering = ['-creation_date', '-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-creation_date', '-id'],
+                name='recipe_feed_idx'
+            ),
+            models.Index(
+                fields=['author', '-creation_date'],
+                name='recipe_author_feed_idx'
+            ),
+            models.Index(
+                fields=['-updated_at'],
+                name='recipe_updated_idx'
+            ),
+        ] + ([
+            GinIndex(fields=['search_vector'], name='recipe_search_idx'),
+        ] if POSTGRES else [])
 
     def __str__(self):
         return self.name
 
+    def update_image_variants(self, force=False):
+        """Пересоздание уменьшенных копий изображения,
+        если исходное изображение изменилось
+        """
+        source = self.image.name or ''
+        if source == self.image_variants_source and not force:
+            return False
+
+        variants = make_image_variants(self.image) if source else {
+            field_name: '' for field_name in IMAGE_VARIANTS
+        }
+        for field_name, name in variants.items():
+            setattr(self, field_name, name)
+        self.image_variants_source = source
+        # update() вместо save(): без повторных сигналов и смены updated_at
+        Recipe.objects.filter(pk=self.pk).update(
+            image_variants_source=source,
+            **variants
+        )
+        return True
+
+    def get_image_url(self, variant=None):
+        """URL варианта изображения, а при его отсутствии - исходника"""
+        image = getattr(self, variant) if variant else None
+        if not image:
+            image = self.image
+        return image.url if image else None
+
+
+class DeletedRecipe(models.Model):
+    """Отметка удаления рецепта.
+
+    Удаление не оставляет следа в таблице рецептов, поэтому
+    ETag списков учитывает id последней отметки. Хранится
+    только последняя отметка
+    """
+    recipe_id = models.IntegerField(
+        verbose_name='id рецепта',
+    )
+    deleted_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='дата удаления',
+    )
+
+    class Meta:
+        verbose_name = 'Удаленный рецепт'
+        verbose_name_plural = 'Удаленные рецепты'
+
+
+class RecipeTag(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='рецепт',
+    )
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        verbose_name='тег',
+    )
+
+    class Meta:
+        # Таблица та же, что у автоматической связи рецептов и тегов
+        db_table = 'recipe_recipe_tags'
+        verbose_name = 'Тег рецепта'
+        verbose_name_plural = 'Теги рецептов'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'tag'],
+                name='unique_recipe_tag'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['tag', 'recipe'],
+                name='recipe_tag_by_tag_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return '{}_{}'.format(self.recipe_id, self.tag_id)
+
 
 class IngredientAmount(models.Model):
     ingredient = models.ForeignKey(
@@ -200,3 +432,87 @@ class ShoppingCart(models.Model):
                 name='unique_recipe_in_cart'
             )
         ]
+
+
+class TimelineEntry(models.Model):
+    """Запись ленты пользователя: рецепт автора, на которого он подписан.
+
+    Заполняется при публикации рецепта и при подписке,
+    чтобы чтение ленты было выборкой по индексу одного пользователя
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='пользователь',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='автор',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='рецепт',
+    )
+    creation_date = models.DateTimeField(
+        verbose_name='дата публикации рецепта',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-creation_date', '-id'],
+                name='timeline_feed_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='timeline_author_idx'
+            ),
+        ]
+
+
+class ShoppingListItem(models.Model):
+    """Строка списка покупок пользователя: сумма ингредиента
+    по всем рецептам его корзины.
+
+    Поддерживается изменениями корзины и ингредиентов рецептов,
+    чтобы список читался одной выборкой по индексу пользователя
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='ингредиент',
+    )
+    amount = models.IntegerField(
+        default=0,
+        verbose_name='количество',
+    )
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_ingredient'
+            )
+        ]
@@ -0,0 +1,145 @@
+from django.db import connections, router
+
+from .counters import change_counter
+from .models import Favorites, Recipe, ShoppingCart, Subscription
+from .shopping_list import add_recipes_to_list
+from .timeline import backfill_timeline, prune_timeline
+
+
+def change_favorites(user_id, recipe_ids, sign=1):
+    change_counter(Recipe, 'favorites_count', recipe_ids, sign)
+
+
+def change_cart(user_id, recipe_ids, sign=1):
+    change_counter(Recipe, 'in_carts_count', recipe_ids, sign)
+    add_recipes_to_list(user_id, recipe_ids, sign)
+
+
+def change_subscriptions(user_id, author_ids, sign=1):
+    if sign > 0:
+        backfill_timeline(user_id, author_ids)
+    else:
+        prune_timeline(user_id, author_ids)
+
+
+RELATION_HANDLERS = {
+    Favorites: change_favorites,
+    ShoppingCart: change_cart,
+    Subscription: change_subscriptions,
+}
+
+# Поле связи, указывающее на объект (рецепт или автора)
+RELATION_TARGETS = {
+    Favorites: 'recipe',
+    ShoppingCart: 'recipe',
+    Subscription: 'to_follow',
+}
+
+
+def get_relation_target(instance):
+    return getattr(instance, RELATION_TARGETS[type(instance)] + '_id')
+
+
+def relation_changed(model, user_id, target_ids, sign=1):
+    """Зависимые данные связей пользователя (избранное, корзина,
+    подписки): счетчики, список покупок, лента.
+
+    Вызывается сигналами для одиночных записей и напрямую -
+    для пакетных операций, которые сигналы не отправляют
+    """
+    target_ids = list(target_ids)
+    if target_ids:
+        RELATION_HANDLERS[model](user_id, target_ids, sign)
+
+
+def relation_columns(connection, model):
+    """Таблица и столбцы связи (пользователь, объект) в кавычках базы"""
+    opts = model._meta
+    return [
+        connection.ops.quote_name(name) for name in (
+            opts.db_table,
+            opts.get_field('user').column,
+            opts.get_field(RELATION_TARGETS[model]).column,
+        )
+    ]
+
+
+def related_target_ids(connection, model, user_id, target_ids):
+    """id объектов из target_ids, с которыми пользователь уже связан"""
+    target_field = RELATION_TARGETS[model] + '_id'
+    return set(model.objects.using(connection.alias).filter(
+        user_id=user_id, **{target_field + '__in': target_ids}
+    ).values_list(target_field, flat=True))
+
+
+def insert_relations(model, user_id, target_ids):
+    """Добавление связей пользователя без сигналов.
+
+    Возвращает id объектов, для которых строка действительно вставлена.
+    В Postgres - один INSERT ... ON CONFLICT DO NOTHING RETURNING:
+    строки, вставленные конкурентным запросом, не попадают в ответ.
+    В остальных базах - выборка существующих и одна пакетная вставка
+    в транзакции вызывающего
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+        return []
+    connection = connections[router.db_for_write(model)]
+
+    if connection.vendor != 'postgresql':
+        existing = related_target_ids(connection, model, user_id, target_ids)
+        inserted = [pk for pk in target_ids if pk not in existing]
+        model.objects.using(connection.alias).bulk_create(
+            [
+                model(user_id=user_id,
+                      **{RELATION_TARGETS[model] + '_id': pk})
+                for pk in inserted
+            ],
+            ignore_conflicts=True
+        )
+        return inserted
+
+    table, user_column, target_column = relation_columns(connection, model)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {} ({}, {}) VALUES {} '
+            'ON CONFLICT DO NOTHING RETURNING {}'.format(
+                table, user_column, target_column,
+                ', '.join(['(%s, %s)'] * len(target_ids)), target_column
+            ),
+            [param for pk in target_ids for param in (user_id, pk)]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def delete_relations(model, user_id, target_ids):
+    """Удаление связей пользователя одним DELETE без сборщика и сигналов.
+
+    Возвращает id объектов, связь с которыми действительно удалена.
+    В Postgres они берутся из DELETE ... RETURNING, в остальных
+    базах - выборкой перед удалением
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+        return []
+    connection = connections[router.db_for_write(model)]
+    postgres = connection.vendor == 'postgresql'
+    if not postgres:
+        related = related_target_ids(connection, model, user_id, target_ids)
+        target_ids = [pk for pk in target_ids if pk in related]
+        if not target_ids:
+            return []
+
+    table, user_column, target_column = relation_columns(connection, model)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE {} = %s AND {} IN ({}){}'.format(
+                table, user_column, target_column,
+                ', '.join(['%s'] * len(target_ids)),
+                ' RETURNING {}'.format(target_column) if postgres else ''
+            ),
+            [user_id, *target_ids]
+        )
+        if postgres:
+            return [row[0] for row in cursor.fetchall()]
+    return target_ids
@@ -0,0 +1,187 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection, connections
+from django.db.models import F, OuterRef, Subquery, TextField
+from django.db.models.expressions import RawSQL
+
+from .models import Ingredient, IngredientAmount, Recipe
+
+# Таблица FTS5 для разработки на SQLite; rowid совпадает с id рецепта
+FTS_TABLE = 'recipe_search'
+BATCH_SIZE = 500
+
+WORD = re.compile(r'\w+')
+# Окончания для упрощенного стемминга в FTS5: там нет русской морфологии
+ENDINGS = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ей', 'ую', 'юю',
+    'а', 'я', 'ы', 'и', 'о', 'е', 'у', 'ю', 'ь',
+), key=len, reverse=True)
+MIN_STEM = 3
+
+
+def is_postgres(alias='default'):
+    return connections[alias].vendor == 'postgresql'
+
+
+def normalize(value):
+    return value.lower().replace('ё', 'е')
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def fts_query(text):
+    """Запрос FTS5: все слова обязательны, поиск по основе слова"""
+    return ' '.join(
+        '"{}"*'.format(stem(word)) for word in WORD.findall(normalize(text))
+    )
+
+
+def search_vector():
+    """Взвешенный вектор: название, ингредиенты, текст"""
+    from django.contrib.postgres.aggregates import StringAgg
+
+    config = settings.SEARCH_CONFIG
+    ingredient_names = Subquery(
+        IngredientAmount.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names'),
+        output_field=TextField()
+    )
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(ingredient_names, weight='B', config=config)
+        + SearchVector('text', weight='C', config=config)
+    )
+
+
+def fts_select(where=''):
+    """SELECT строк FTS5 из рецептов; ё заменяется на е"""
+    ingredient_names = (
+        'SELECT group_concat(i.name, \' \') FROM {amount} a '
+        'JOIN {ingredient} i ON i.id = a.ingredient_id '
+        'WHERE a.recipe_id = r.id'
+    ).format(
+        amount=IngredientAmount._meta.db_table,
+        ingredient=Ingredient._meta.db_table,
+    )
+    columns = ', '.join(
+        'replace(replace(coalesce({}, \'\'), \'ё\', \'е\'), \'Ё\', \'Е\')'
+        .format(column)
+        for column in ('r.name', '({})'.format(ingredient_names), 'r.text')
+    )
+    return 'SELECT r.id, {} FROM {} r {}'.format(
+        columns, Recipe._meta.db_table, where
+    )
+
+
+def create_search_table(using='default'):
+    """Создание таблицы FTS5 (только SQLite)"""
+    if connections[using].vendor != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5('
+            'name, ingredients, text, '
+            'tokenize = \'unicode61 remove_diacritics 2\')'.format(FTS_TABLE)
+        )
+
+
+def update_search_index(recipe_ids):
+    """Пересчет поискового индекса для указанных рецептов"""
+    recipe_ids = list(set(recipe_ids))
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        if is_postgres():
+            Recipe.objects.filter(pk__in=batch).update(
+                search_vector=search_vector()
+            )
+        elif connection.vendor == 'sqlite':
+            placeholders = ', '.join(['%s'] * len(batch))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM {} WHERE rowid IN ({})'.format(
+                        FTS_TABLE, placeholders
+                    ),
+                    batch
+                )
+                cursor.execute(
+                    'INSERT INTO {} (rowid, name, ingredients, text) {}'
+                    .format(
+                        FTS_TABLE,
+                        fts_select('WHERE r.id IN ({})'.format(placeholders))
+                    ),
+                    batch
+                )
+
+
+def rebuild_search_index():
+    """Полное перестроение индекса; возвращает число рецептов"""
+    if is_postgres():
+        return Recipe.objects.update(search_vector=search_vector())
+    if connection.vendor != 'sqlite':
+        return 0
+    create_search_table()
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        cursor.execute(
+            'INSERT INTO {} (rowid, name, ingredients, text) {}'.format(
+                FTS_TABLE, fts_select()
+            )
+        )
+        return cursor.rowcount
+
+
+def remove_from_search_index(recipe_ids):
+    """Удаление рецептов из FTS5; в Postgres вектор удаляется со строкой"""
+    if connection.vendor != 'sqlite':
+        return
+    recipe_ids = list(recipe_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE rowid IN ({})'.format(
+                FTS_TABLE, ', '.join(['%s'] * len(recipe_ids))
+            ),
+            recipe_ids
+        )
+
+
+def search_recipes(queryset, text):
+    """Отбор рецептов по запросу с сортировкой по релевантности"""
+    alias = queryset.db
+    if is_postgres(alias):
+        query = SearchQuery(text, config=settings.SEARCH_CONFIG)
+        queryset = queryset.annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).filter(search_vector=query)
+    elif connections[alias].vendor == 'sqlite':
+        match = fts_query(text)
+        if not match:
+            return queryset.none()
+        # IN через extra: RawSQL в pk__in оборачивается в лишние скобки,
+        # и SQLite сравнивает только с первой строкой подзапроса.
+        # bm25: название весомее ингредиентов, ингредиенты весомее текста
+        table = Recipe._meta.db_table
+        queryset = queryset.extra(
+            where=['{0}.id IN (SELECT rowid FROM {1} WHERE {1} MATCH %s)'
+                   .format(table, FTS_TABLE)],
+            params=[match]
+        ).annotate(search_rank=RawSQL(
+            'SELECT -bm25({0}, 10.0, 5.0, 1.0) FROM {0} '
+            'WHERE {0} MATCH %s AND rowid = {1}.id'.format(FTS_TABLE, table),
+            (match, )
+        ))
+    else:
+        return queryset.filter(name__icontains=text)
+    return queryset.order_by('-search_rank', '-creation_date', '-id')
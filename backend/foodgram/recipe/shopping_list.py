@@ -0,0 +1,181 @@
+from itertools import islice
+
+from django.db import connections, router, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .models import IngredientAmount, ShoppingCart, ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+def apply_deltas(user_ids, deltas):
+    """Изменение списков покупок пользователей на дельты
+    {ingredient_id: delta} фиксированным числом запросов.
+    Строки с нулевым остатком удаляются
+    """
+    user_ids = list(user_ids)
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not user_ids or not deltas:
+        return
+
+    connection = connections[router.db_for_write(ShoppingListItem)]
+    if connection.vendor == 'postgresql':
+        upsert_deltas(connection, user_ids, deltas)
+    else:
+        ShoppingListItem.objects.bulk_create(
+            [
+                ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id)
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items() if delta > 0
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        # Все дельты - одним UPDATE
+        ShoppingListItem.objects.filter(
+            user_id__in=user_ids,
+            ingredient_id__in=list(deltas)
+        ).update(amount=F('amount') + Case(
+            *[
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ],
+            output_field=IntegerField()
+        ))
+
+    if any(delta < 0 for delta in deltas.values()):
+        ShoppingListItem.objects.filter(
+            user_id__in=user_ids,
+            ingredient_id__in=list(deltas),
+            amount__lte=0
+        ).delete()
+
+
+def upsert_deltas(connection, user_ids, deltas):
+    """INSERT ... ON CONFLICT DO UPDATE: вставка и прибавление
+    дельт одним запросом на пакет строк
+    """
+    opts = ShoppingListItem._meta
+    table, user_column, ingredient_column, amount_column = [
+        connection.ops.quote_name(name) for name in (
+            opts.db_table,
+            opts.get_field('user').column,
+            opts.get_field('ingredient').column,
+            opts.get_field('amount').column,
+        )
+    ]
+    rows = iter([
+        (user_id, ingredient_id, delta)
+        for user_id in user_ids
+        for ingredient_id, delta in deltas.items()
+    ])
+    with connection.cursor() as cursor:
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                return
+            cursor.execute(
+                'INSERT INTO {table} ({user}, {ingredient}, {amount}) '
+                'VALUES {values} ON CONFLICT ({user}, {ingredient}) '
+                'DO UPDATE SET {amount} = {table}.{amount} '
+                '+ EXCLUDED.{amount}'.format(
+                    table=table, user=user_column,
+                    ingredient=ingredient_column, amount=amount_column,
+                    values=', '.join(['(%s, %s, %s)'] * len(batch))
+                ),
+                [param for row in batch for param in row]
+            )
+
+
+def delete_recipe_ingredients(recipe_id, ingredient_ids):
+    """Удаление ингредиентов рецепта одним DELETE без сигналов:
+    списки покупок вызывающий правит общей дельтой
+    """
+    ingredient_ids = list(ingredient_ids)
+    if not ingredient_ids:
+        return
+    connection = connections[router.db_for_write(IngredientAmount)]
+    opts = IngredientAmount._meta
+    table, recipe_column, ingredient_column = [
+        connection.ops.quote_name(name) for name in (
+            opts.db_table,
+            opts.get_field('recipe').column,
+            opts.get_field('ingredient').column,
+        )
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {} WHERE {} = %s AND {} IN ({})'.format(
+                table, recipe_column, ingredient_column,
+                ', '.join(['%s'] * len(ingredient_ids))
+            ),
+            [recipe_id, *ingredient_ids]
+        )
+
+
+def add_recipes_to_list(user_id, recipe_ids, sign=1):
+    """Рецепты добавлены в корзину (sign=-1 - убраны из нее)"""
+    totals = IngredientAmount.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id').annotate(total=Sum('amount')).order_by()
+    apply_deltas([user_id], {
+        row['ingredient_id']: sign * row['total'] for row in totals
+    })
+
+
+def change_recipe_amounts(recipe_id, deltas):
+    """Ингредиенты рецепта изменились: дельты применяются к спискам
+    всех пользователей, у которых рецепт в корзине
+    """
+    if not any(deltas.values()):
+        return
+    apply_deltas(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True),
+        deltas
+    )
+
+
+def get_shopping_list(user):
+    """Список покупок: одна выборка по индексу пользователя"""
+    return ShoppingListItem.objects.filter(
+        user=user,
+        amount__gt=0
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by('ingredient__name')
+
+
+def rebuild_shopping_lists(user_ids=None):
+    """Пересчет списков с нуля по корзинам; возвращает число строк"""
+    items = ShoppingListItem.objects.all()
+    # Условия на корзину - одним filter(), чтобы соединение было одно
+    cart_filter = {'recipe__cart_list__isnull': False}
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+        cart_filter = {'recipe__cart_list__user_id__in': user_ids}
+    totals = IngredientAmount.objects.filter(**cart_filter).values(
+        'recipe__cart_list__user_id', 'ingredient_id'
+    ).annotate(total=Sum('amount')).order_by()
+
+    rows = (
+        ShoppingListItem(
+            user_id=row['recipe__cart_list__user_id'],
+            ingredient_id=row['ingredient_id'],
+            amount=row['total'],
+        )
+        for row in totals.iterator()
+    )
+    count = 0
+    with transaction.atomic():
+        items.delete()
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                return count
+            ShoppingListItem.objects.bulk_create(batch)
+            count += len(batch)
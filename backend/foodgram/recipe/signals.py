@@ -0,0 +1,188 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .counters import change_counter
+from .models import (DeletedRecipe, Favorites, Ingredient, IngredientAmount,
+                     Recipe, ShoppingCart, Subscription, Tag)
+from .relations import get_relation_target, relation_changed
+from .search import (create_search_table, remove_from_search_index,
+                     update_search_index)
+from .shopping_list import change_recipe_amounts
+from .timeline import fan_out_recipe
+
+User = get_user_model()
+
+# Поля автора, которые отображаются в рецепте
+AUTHOR_FIELDS = {'username', 'email', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_image_variants(sender, instance, raw=False, **kwargs):
+    """Варианты изображения пересоздаются только при смене исходника"""
+    if not raw:
+        instance.update_image_variants()
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(User, 'recipes_count', [instance.author_id], 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(User, 'recipes_count', [instance.author_id], -1)
+
+
+@receiver(post_delete, sender=Recipe)
+def mark_recipe_deleted(sender, instance, **kwargs):
+    marker = DeletedRecipe.objects.create(recipe_id=instance.pk)
+    DeletedRecipe.objects.filter(id__lt=marker.id).delete()
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+def add_relation(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        relation_changed(
+            sender, instance.user_id, [get_relation_target(instance)]
+        )
+
+
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscription)
+def remove_relation(sender, instance, **kwargs):
+    # При каскадном удалении рецепта его ингредиенты могут быть
+    # уже удалены: тогда списки покупок поправил обработчик
+    # удаления IngredientAmount
+    relation_changed(
+        sender, instance.user_id, [get_relation_target(instance)], -1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_timelines(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        fan_out_recipe(instance)
+
+
+def schedule_search_update(recipe_ids):
+    """Индекс пересчитывается после фиксации транзакции:
+    к этому моменту сохранены и ингредиенты рецепта.
+
+    id копятся в наборе соединения, и первый же обработчик
+    on_commit переиндексирует каждый рецепт один раз; остальные
+    обработчики той же транзакции находят набор пустым
+    """
+    connection = transaction.get_connection()
+    if not hasattr(connection, 'pending_search_updates'):
+        connection.pending_search_updates = set()
+    connection.pending_search_updates.update(recipe_ids)
+    transaction.on_commit(lambda: run_search_updates(connection))
+
+
+def run_search_updates(connection):
+    recipe_ids = list(connection.pending_search_updates)
+    connection.pending_search_updates.clear()
+    if recipe_ids:
+        update_search_index(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_search_update([instance.pk])
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(sender, instance, **kwargs):
+    remove_from_search_index([instance.pk])
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def index_recipe_ingredients(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_search_update([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def index_ingredient_recipes(sender, instance, created, raw=False,
+                             **kwargs):
+    if not created and not raw:
+        schedule_search_update(
+            IngredientAmount.objects.filter(
+                ingredient=instance
+            ).values_list('recipe_id', flat=True)
+        )
+
+
+@receiver(post_migrate)
+def create_recipe_search_table(sender, using, **kwargs):
+    if sender.name == 'recipe':
+        create_search_table(using)
+
+
+@receiver(pre_save, sender=IngredientAmount)
+def remember_ingredient_amount(sender, instance, raw=False, **kwargs):
+    """Прежние ингредиент и количество - для дельты списков покупок"""
+    instance.previous_amount = None
+    if not raw and not instance._state.adding:
+        instance.previous_amount = IngredientAmount.objects.filter(
+            pk=instance.pk
+        ).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientAmount)
+def change_shopping_lists(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {instance.ingredient_id: instance.amount}
+    if instance.previous_amount is not None:
+        ingredient_id, amount = instance.previous_amount
+        deltas[ingredient_id] = deltas.get(ingredient_id, 0) - amount
+    change_recipe_amounts(instance.recipe_id, deltas)
+
+
+@receiver(post_delete, sender=IngredientAmount)
+def reduce_shopping_lists(sender, instance, **kwargs):
+    change_recipe_amounts(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount}
+    )
+
+
+def touch_recipes(**lookup):
+    """Отображение рецептов изменилось без их сохранения (теги,
+    ингредиенты, автор): новая дата изменения меняет ETag ответов
+    """
+    Recipe.objects.filter(**lookup).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch_recipes(tags=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch_recipes(ingredients=instance)
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, raw=False,
+                         update_fields=None, **kwargs):
+    # Сохранение только last_login при входе рецептов не меняет
+    if created or raw or (update_fields is not None
+                          and not AUTHOR_FIELDS.intersection(update_fields)):
+        return
+    touch_recipes(author=instance)
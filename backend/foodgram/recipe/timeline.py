@@ -0,0 +1,53 @@
+from itertools import islice
+
+from .models import Recipe, Subscription, TimelineEntry
+
+BATCH_SIZE = 1000
+
+
+def bulk_insert(entries):
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, BATCH_SIZE))
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_recipe(recipe):
+    """Новый рецепт попадает в ленты всех подписчиков автора"""
+    subscribers = Subscription.objects.filter(
+        to_follow=recipe.author_id
+    ).values_list('user_id', flat=True)
+    bulk_insert(
+        TimelineEntry(
+            user_id=user_id,
+            author_id=recipe.author_id,
+            recipe_id=recipe.id,
+            creation_date=recipe.creation_date,
+        )
+        for user_id in subscribers.iterator()
+    )
+
+
+def backfill_timeline(user_id, author_ids):
+    """После подписки в ленту добавляются уже опубликованные рецепты"""
+    recipes = Recipe.objects.filter(
+        author__in=author_ids
+    ).order_by().values_list('id', 'author_id', 'creation_date')
+    bulk_insert(
+        TimelineEntry(
+            user_id=user_id,
+            author_id=author_id,
+            recipe_id=recipe_id,
+            creation_date=creation_date,
+        )
+        for recipe_id, author_id, creation_date in recipes.iterator()
+    )
+
+
+def prune_timeline(user_id, author_ids):
+    """После отписки рецепты авторов убираются из ленты"""
+    TimelineEntry.objects.filter(
+        user=user_id, author__in=author_ids
+    ).delete()
@@ -8,4 +8,6 @@ User = get_user_model()
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'password',
                     'email', 'first_name', 'last_name')
-    list_filter = ('username', 'email')
+    list_filter = ('role', 'is_staff')
+    search_fields = ('username', 'email')
+    show_full_result_count = False
@@ -1,8 +1,31 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as BaseUserManager
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
 from django.utils.translation import gettext_lazy as _
 
 
+class UserQuerySet(models.QuerySet):
+
+    def with_is_followed(self, user):
+        """Аннотация is_followed:
+        подписан ли пользователь user на пользователя из выборки
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_followed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_followed=Exists(
+                user.subscriber.filter(to_follow=OuterRef('pk'))
+            )
+        )
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     USER = 'user'
     ADMIN = 'admin'
@@ -23,6 +46,13 @@ class User(AbstractUser):
         'роль', choices=ROLES,
         default='user', max_length=10
     )
+    recipes_count = models.IntegerField(
+        'количество рецептов',
+        default=0,
+        editable=False
+    )
+
+    objects = UserManager()
 
     REQUIRED_FIELDS = [
         'username',